@@ -0,0 +1,55 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Measures the time from a fresh interpreter importing main to the first
+# response, e.g. to compare this tree with an earlier commit:
+#   python benchmarks/cold_start.py --rev HEAD~1
+PROBE = """
+import time
+start = time.perf_counter()
+import main
+response = main.app.test_client().get({path!r})
+print(time.perf_counter() - start, response.status_code)
+"""
+
+
+def measure(tree: str, path: str) -> float:
+    output = subprocess.run([sys.executable, "-c", PROBE.format(path=path)],
+                            cwd=tree, check=True, stdout=subprocess.PIPE,
+                            universal_newlines=True).stdout
+    return float(output.split()[0])
+
+
+def checkout(rev: str, target: str):
+    archive = subprocess.run(["git", "archive", rev], cwd=ROOT, check=True,
+                             stdout=subprocess.PIPE).stdout
+    subprocess.run(["tar", "-x", "-C", target], input=archive, check=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rev", help="also measure this git revision")
+    parser.add_argument("--path", default="/animals")
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    trees = [("working tree", ROOT)]
+    with tempfile.TemporaryDirectory() as target:
+        if args.rev:
+            checkout(args.rev, target)
+            trees.append((args.rev, target))
+
+        for name, tree in trees:
+            times = [measure(tree, args.path) for _ in range(args.runs)]
+            print("%s: median %.1f ms, max %.1f ms" % (
+                name, statistics.median(times) * 1000, max(times) * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+import argparse
+import os
+import re
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+os.environ.setdefault("RATE_LIMIT_BACKEND", "none")
+os.environ.setdefault("MAX_IN_FLIGHT", "0")
+os.environ.setdefault("CACHE_BACKEND", "memory")
+
+import main  # noqa: E402
+
+from constants import ANIMALS, ICEBERGS  # noqa: E402
+from endpoints import authorize  # noqa: E402
+from storage import client  # noqa: E402
+
+# Has many clients move Animals onto the same Iceberg at once, then checks
+# that every Animal's home agrees with the Iceberg's inhabitants. Runs on the
+# in-memory engine, or on the emulator to see real transaction conflicts, e.g.
+#   STORAGE_BACKEND=datastore DATASTORE_EMULATOR_HOST=localhost:8432 \
+#       python benchmarks/contention.py --clients 32
+COMMITS = re.compile(r'commit;dur=[\d.]+;desc="(\d+) calls')
+
+
+def create(test_client, headers, path: str, body: dict) -> str:
+    response = test_client.post(path, json=body, headers=headers)
+    if response.status_code != 201:
+        raise RuntimeError("POST %s returned %d" % (
+            path, response.status_code))
+    return response.get_json()["id"]
+
+
+def main_():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--animals", type=int, default=10,
+                        help="Animals each client moves")
+    args = parser.parse_args()
+
+    headers = dict(authorize("bench"), Accept="application/json")
+    test_client = main.app.test_client()
+    run = str(int(time.time()))
+    iceberg_id = create(test_client, headers, "/icebergs",
+                        {"name": "Contention " + run, "area": 10,
+                         "shape": "dome", "public": True})
+    animal_ids = [[create(test_client, headers, "/animals",
+                          {"name": "Contention %s %d %d" % (run, c, n),
+                           "species": "bench", "height": 1})
+                   for n in range(args.animals)]
+                  for c in range(args.clients)]
+
+    lock = threading.Lock()
+    latencies = []
+    commits = []
+    failures = []
+
+    def client_thread(ids):
+        thread_client = main.app.test_client()
+        for animal_id in ids:
+            path = "/icebergs/%s/animals/%s" % (iceberg_id, animal_id)
+            start = time.perf_counter()
+            response = thread_client.put(path, json={}, headers=headers)
+            elapsed = time.perf_counter() - start
+            timing = COMMITS.search(response.headers.get("Server-Timing",
+                                                         ""))
+            with lock:
+                latencies.append(elapsed)
+                commits.append(int(timing.group(1)) if timing else 0)
+                if response.status_code != 303:
+                    failures.append(response.status_code)
+
+    threads = [threading.Thread(target=client_thread, args=(ids,))
+               for ids in animal_ids]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    total = time.perf_counter() - start
+
+    # Every Animal that was moved must be listed on the Iceberg and the other
+    # way around
+    with main.app.app_context():
+        iceberg = client.get(client.key(ICEBERGS, int(iceberg_id)))
+        keys = [client.key(ANIMALS, int(animal_id))
+                for ids in animal_ids for animal_id in ids]
+        homes = {str(animal.id) for animal in client.get_multi(keys)
+                 if animal["home"] == iceberg_id}
+    inhabitants = set(iceberg["inhabitants"] or [])
+
+    latencies.sort()
+    print("requests     %d" % len(latencies))
+    print("failed       %d %s" % (len(failures), sorted(set(failures))))
+    print("p50 ms       %.2f" % (statistics.median(latencies) * 1000))
+    print("p99 ms       %.2f" % (latencies[int(len(latencies) * 0.99)] * 1000))
+    print("req/s        %.0f" % (len(latencies) / total))
+    print("commits/req  %.2f" % (sum(commits) / len(commits)))
+    print("consistent   %s" % (homes == inhabitants))
+    if homes != inhabitants:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_()
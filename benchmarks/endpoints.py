@@ -0,0 +1,269 @@
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+os.environ.setdefault("RATE_LIMIT_BACKEND", "none")
+os.environ.setdefault("MAX_IN_FLIGHT", "0")
+# Budgets hold without the entity cache, as deployed without REDIS_URL
+os.environ.setdefault("CACHE_BACKEND", "none")
+
+import main  # noqa: E402
+import tokens  # noqa: E402
+
+from cache import CachedClient  # noqa: E402
+from constants import ANIMALS, BATCH_SIZE, ICEBERGS, NAMES, USERS  # noqa
+from google.cloud import datastore  # noqa: E402
+from helpers import chunks  # noqa: E402
+from memory import MemoryClient  # noqa: E402
+
+# Drives every route through the Flask test client against the in-memory
+# engine and fails when a route makes more storage calls than its budget, e.g.
+#   python benchmarks/endpoints.py --sizes 1000 100000
+SIZES = {"1k": 1000, "100k": 100000, "1M": 1000000}
+SHAPES = ["tabular", "dome", "pinnacle", "wedge", "dry-dock", "blocky"]
+INHABITANTS = 5
+
+# Most storage calls (RPCs) one request of each route may make, counting the
+# BeginTransaction and Commit of every transaction
+BUDGETS = {
+    "GET /icebergs": 1,
+    "GET /icebergs?fields": 1,
+    "GET /icebergs?filters": 1,
+    "GET /icebergs/<id>": 2,
+    "PUT /icebergs/<id>": 7,
+    "PATCH /icebergs/<id>": 7,
+    "DELETE /icebergs/<id>": 6,
+    "POST /icebergs": 5,
+    "POST /icebergs/batch": 5,
+    "PUT /icebergs/<id>/animals": 4,
+    "DELETE /icebergs/<id>/animals": 4,
+    "PUT /icebergs/<id>/animals/<animal_id>": 4,
+    "DELETE /icebergs/<id>/animals/<animal_id>": 3,
+    "GET /animals": 1,
+    "GET /animals?fields": 1,
+    "GET /animals?filters": 1,
+    "GET /animals/<id>": 2,
+    "PUT /animals/<id>": 7,
+    "PATCH /animals/<id>": 7,
+    "DELETE /animals/<id>": 5,
+    "POST /animals": 5,
+    "POST /animals/batch": 5,
+    "GET /users": 1,
+    "GET /users/<user_id>/icebergs": 1,
+    "GET /stats": 1,
+}
+
+
+class CountingClient(MemoryClient):
+    calls = 0
+
+    def _rpc(self):
+        self.calls += 1
+        super()._rpc()
+
+
+def authorize(sub: str) -> dict:
+    token = "bench-" + sub
+    digest = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    tokens.token_cache.put(digest, {"sub": sub, "exp": time.time() + 86400})
+    return {"Authorization": "Bearer " + token}
+
+
+def seed(engine, size: int):
+    users = max(size // 100, 1)
+    icebergs = []
+    animals = []
+    reservations = []
+    for n in range(size):
+        iceberg = datastore.Entity(key=engine.key(ICEBERGS, n + 1))
+        iceberg.update({"name": "Iceberg %d" % n,
+                        "area": n % 8000,
+                        "shape": SHAPES[n % len(SHAPES)],
+                        "inhabitants": None,
+                        "public": n % 2 == 0,
+                        "founder": "user%d" % (n % users)})
+        icebergs.append(iceberg)
+
+    for n in range(size):
+        animal = datastore.Entity(key=engine.key(ANIMALS, size + n + 1))
+        animal.update({"name": "Animal %d" % n,
+                       "species": "species%d" % (n % 50),
+                       "height": n % 25,
+                       "home": None})
+        # Half of the Animals live on the first Icebergs
+        if n < size // 2:
+            iceberg = icebergs[n // INHABITANTS]
+            animal["home"] = str(iceberg.key.id)
+            iceberg["inhabitants"] = (iceberg["inhabitants"] or [])
+            iceberg["inhabitants"].append(str(animal.key.id))
+        animals.append(animal)
+
+    for entity in icebergs + animals:
+        reservation = datastore.Entity(
+            key=engine.key(NAMES, entity.kind + ":" + entity["name"]))
+        reservation.update({"owner": str(entity.key.id)})
+        reservations.append(reservation)
+
+    user_entities = []
+    for n in range(users):
+        user = datastore.Entity(key=engine.key(USERS, "user%d" % n))
+        user.update({"id": "user%d" % n})
+        user_entities.append(user)
+
+    for batch in chunks(icebergs + animals + reservations + user_entities,
+                        BATCH_SIZE):
+        engine.put_multi(batch)
+
+
+def scenarios(size: int):
+    # Each scenario returns the next request it makes, one per iteration
+    founder = authorize("user0")
+    users = max(size // 100, 1)
+    counter = itertools.count()
+    homeless = iter(range(size + size // 2 + 1, 2 * size + 1))
+    owned = iter(range(1 + users * (size // users - 1), 1, -users))
+    moved = []
+    moved_batches = []
+
+    def new_animal(n):
+        return {"name": "New Animal %d" % n, "species": "bench", "height": 3}
+
+    def new_iceberg(n):
+        return {"name": "New Iceberg %d" % n, "area": 10, "shape": "dome",
+                "public": True}
+
+    def move_in():
+        moved.append(next(homeless))
+        return "PUT", "/icebergs/1/animals/%d" % moved[-1], {}, founder
+
+    def move_out():
+        return "DELETE", "/icebergs/1/animals/%d" % moved.pop(), {}, founder
+
+    def move_many_in():
+        moved_batches.append([str(next(homeless)) for _ in range(5)])
+        return ("PUT", "/icebergs/2/animals",
+                {"animals": moved_batches[-1]}, founder)
+
+    def move_many_out():
+        return ("DELETE", "/icebergs/2/animals",
+                {"animals": moved_batches.pop()}, founder)
+
+    yield "GET /icebergs", lambda: ("GET", "/icebergs?limit=5", None, founder)
+    yield "GET /icebergs?fields", lambda: (
+        "GET", "/icebergs?limit=5&fields=id,name", None, founder)
+    yield "GET /icebergs?filters", lambda: (
+        "GET", "/icebergs?limit=5&shape=dome&min_area=100&order=-area",
+        None, founder)
+    yield "GET /icebergs/<id>", lambda: (
+        "GET", "/icebergs/1", None, founder)
+    yield "PUT /icebergs/<id>", lambda: (
+        "PUT", "/icebergs/1", new_iceberg(next(counter)), founder)
+    yield "PATCH /icebergs/<id>", lambda: (
+        "PATCH", "/icebergs/1", {"name": "Patched %d" % next(counter)},
+        founder)
+    yield "POST /icebergs", lambda: (
+        "POST", "/icebergs", new_iceberg(next(counter)), founder)
+    yield "POST /icebergs/batch", lambda: (
+        "POST", "/icebergs/batch",
+        [new_iceberg(next(counter)) for _ in range(10)], founder)
+    yield "PUT /icebergs/<id>/animals/<animal_id>", move_in
+    yield "DELETE /icebergs/<id>/animals/<animal_id>", move_out
+    yield "PUT /icebergs/<id>/animals", move_many_in
+    yield "DELETE /icebergs/<id>/animals", move_many_out
+
+    yield "GET /animals", lambda: ("GET", "/animals?limit=5", None, None)
+    yield "GET /animals?fields", lambda: (
+        "GET", "/animals?limit=5&fields=self", None, None)
+    yield "GET /animals?filters", lambda: (
+        "GET", "/animals?limit=5&species=species1&order=height", None, None)
+    yield "GET /animals/<id>", lambda: (
+        "GET", "/animals/%d" % (size + 1), None, None)
+    yield "PUT /animals/<id>", lambda: (
+        "PUT", "/animals/%d" % (size + 1), new_animal(next(counter)), None)
+    yield "PATCH /animals/<id>", lambda: (
+        "PATCH", "/animals/%d" % (size + 1),
+        {"name": "Patched %d" % next(counter)}, None)
+    yield "POST /animals", lambda: (
+        "POST", "/animals", new_animal(next(counter)), None)
+    yield "POST /animals/batch", lambda: (
+        "POST", "/animals/batch",
+        [new_animal(next(counter)) for _ in range(10)], None)
+    yield "GET /users", lambda: ("GET", "/users", None, None)
+    yield "GET /users/<user_id>/icebergs", lambda: (
+        "GET", "/users/user0/icebergs?limit=5", None, founder)
+    yield "GET /stats", lambda: ("GET", "/stats", None, None)
+
+    # Destructive scenarios run last, on entities nothing else uses
+    yield "DELETE /animals/<id>", lambda: (
+        "DELETE", "/animals/%d" % next(homeless), None, None)
+    yield "DELETE /icebergs/<id>", lambda: (
+        "DELETE", "/icebergs/%d" % next(owned), None, founder)
+
+
+def run(size: int, requests: int) -> list:
+    app = main.create_app()
+    engine = CountingClient()
+    app.extensions["datastore"] = CachedClient(engine)
+    seed(engine, size)
+    client = app.test_client()
+
+    report = []
+    for name, make_request in scenarios(size):
+        latencies = []
+        calls = []
+        for _ in range(requests):
+            method, path, body, headers = make_request()
+            headers = dict(headers or {}, Accept="application/json")
+            before = engine.calls
+            start = time.perf_counter()
+            response = client.open(path, method=method,
+                                   data=json.dumps(body), headers=headers,
+                                   content_type="application/json")
+            latencies.append(time.perf_counter() - start)
+            calls.append(engine.calls - before)
+            if response.status_code >= 400:
+                raise RuntimeError("%s returned %d: %s" % (
+                    name, response.status_code, response.get_data()))
+        latencies.sort()
+        report.append({"route": name,
+                       "p50": statistics.median(latencies) * 1000,
+                       "p99": latencies[int(len(latencies) * 0.99)] * 1000,
+                       "rps": len(latencies) / sum(latencies),
+                       "calls": max(calls),
+                       "budget": BUDGETS[name]})
+    return report
+
+
+def main_():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", nargs="+", default=["1k"],
+                        choices=list(SIZES))
+    parser.add_argument("--requests", type=int, default=50)
+    args = parser.parse_args()
+
+    over_budget = []
+    for size in args.sizes:
+        print("%s entities per kind" % size)
+        print("%-45s %9s %9s %9s %6s %6s" % (
+            "route", "p50 ms", "p99 ms", "req/s", "calls", "budget"))
+        for row in run(SIZES[size], args.requests):
+            print("%-45s %9.2f %9.2f %9.0f %6d %6d" % (
+                row["route"], row["p50"], row["p99"], row["rps"],
+                row["calls"], row["budget"]))
+            if row["calls"] > row["budget"]:
+                over_budget.append("%s (%s)" % (row["route"], size))
+
+    if over_budget:
+        print("Over budget: " + ", ".join(over_budget))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,110 @@
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+os.environ.setdefault("RATE_LIMIT_BACKEND", "none")
+os.environ.setdefault("MAX_IN_FLIGHT", "0")
+
+import concurrency  # noqa: E402
+import helpers  # noqa: E402
+import main  # noqa: E402
+
+from cache import CACHE_SIZE, CACHE_TTL, CachedClient, EntityCache,\
+    MemoryStore  # noqa: E402
+from endpoints import authorize, seed  # noqa: E402
+from memory import MemoryClient  # noqa: E402
+
+# Compares tail latency of GET /icebergs/<id> and of moving Animals when each
+# request runs its storage calls and token check one after another, against
+# running them on the fetch pool, e.g.
+#   python benchmarks/fetch_concurrency.py --storage-ms 5 --token-ms 5
+SIZE = 1000
+
+
+def slow_verify_token(delay: float):
+    # Stands in for fetching Google's certificates on a token cache miss
+    verify_token = helpers.verify_token
+
+    def verify(jwt):
+        time.sleep(delay)
+        return verify_token(jwt)
+    return verify
+
+
+def run(clients: int, requests: int, storage_ms: float) -> dict:
+    app = main.create_app()
+    engine = MemoryClient(latency_ms=storage_ms)
+    # Each run starts from a fresh engine and an empty entity cache
+    cache = EntityCache(MemoryStore(CACHE_SIZE), CACHE_TTL)
+    app.extensions["datastore"] = CachedClient(engine, cache)
+    seed(engine, SIZE)
+    headers = dict(authorize("user0"), Accept="application/json")
+    homeless = iter(range(SIZE + SIZE // 2 + 1, 2 * SIZE + 1))
+    lock = threading.Lock()
+    latencies = []
+
+    def client_thread(n: int):
+        test_client = app.test_client()
+        for i in range(requests):
+            if i % 2 == 0:
+                path, method = "/icebergs/%d" % (1 + n * 10), "GET"
+            else:
+                with lock:
+                    animal_id = next(homeless)
+                path = "/icebergs/%d/animals/%d" % (1 + n * 10, animal_id)
+                method = "PUT"
+            start = time.perf_counter()
+            response = test_client.open(path, method=method, headers=headers,
+                                        json={})
+            elapsed = time.perf_counter() - start
+            if response.status_code >= 400:
+                raise RuntimeError("%s %s returned %d" % (
+                    method, path, response.status_code))
+            with lock:
+                latencies.append(elapsed)
+
+    threads = [threading.Thread(target=client_thread, args=(n,))
+               for n in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    total = time.perf_counter() - start
+
+    latencies.sort()
+    return {"p50": statistics.median(latencies) * 1000,
+            "p95": latencies[int(len(latencies) * 0.95)] * 1000,
+            "p99": latencies[int(len(latencies) * 0.99)] * 1000,
+            "rps": len(latencies) / total}
+
+
+def main_():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--storage-ms", type=float, default=5)
+    parser.add_argument("--token-ms", type=float, default=5)
+    args = parser.parse_args()
+
+    helpers.verify_token = slow_verify_token(args.token_ms / 1000)
+    pool = concurrency.executor
+
+    print("%-12s %8s %9s %9s %9s %9s" % (
+        "mode", "clients", "p50 ms", "p95 ms", "p99 ms", "req/s"))
+    for clients in args.clients:
+        for mode, executor in (("sequential", None), ("concurrent", pool)):
+            concurrency.executor = executor
+            row = run(clients, args.requests, args.storage_ms)
+            print("%-12s %8d %9.2f %9.2f %9.2f %9.0f" % (
+                mode, clients, row["p50"], row["p95"], row["p99"],
+                row["rps"]))
+
+
+if __name__ == "__main__":
+    main_()
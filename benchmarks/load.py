@@ -0,0 +1,105 @@
+import argparse
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Load-tests the Flask development server against gunicorn on the in-memory
+# engine with simulated storage latency, e.g.
+#   python benchmarks/load.py --clients 32 --seconds 10
+SERVERS = {
+    "dev": [sys.executable, "main.py"],
+    "gunicorn": [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py",
+                 "wsgi:app"],
+}
+
+
+def start(server: str, port: int, env: dict):
+    process = subprocess.Popen(SERVERS[server], cwd=ROOT, env=env,
+                               stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL,
+                               start_new_session=True)
+    url = "http://127.0.0.1:%d" % port
+    for _ in range(100):
+        try:
+            requests.get(url + "/metrics", timeout=1)
+            return process, url
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    os.killpg(process.pid, signal.SIGTERM)
+    raise RuntimeError("%s did not start" % server)
+
+
+def load(url: str, clients: int, seconds: float) -> dict:
+    lock = threading.Lock()
+    latencies = []
+    errors = []
+    deadline = time.perf_counter() + seconds
+
+    def client_thread():
+        session = requests.Session()
+        headers = {"Accept": "application/json"}
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                response = session.get(url + "/animals", headers=headers,
+                                       timeout=30)
+                failed = response.status_code != 200
+            except requests.RequestException:
+                failed = True
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                if failed:
+                    errors.append(elapsed)
+
+    threads = [threading.Thread(target=client_thread)
+               for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    latencies.sort()
+    return {"rps": len(latencies) / seconds,
+            "p50": statistics.median(latencies) * 1000,
+            "p99": latencies[int(len(latencies) * 0.99)] * 1000,
+            "errors": len(errors)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--servers", nargs="+", default=list(SERVERS),
+                        choices=list(SERVERS))
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--storage-ms", default="5")
+    args = parser.parse_args()
+
+    env = dict(os.environ, PORT=str(args.port), STORAGE_BACKEND="memory",
+               STORAGE_LATENCY_MS=args.storage_ms,
+               RATE_LIMIT_BACKEND="none", MAX_IN_FLIGHT="0")
+
+    print("%-10s %9s %9s %9s %7s" % (
+        "server", "req/s", "p50 ms", "p99 ms", "errors"))
+    for server in args.servers:
+        process, url = start(server, args.port, env)
+        try:
+            row = load(url, args.clients, args.seconds)
+        finally:
+            os.killpg(process.pid, signal.SIGTERM)
+            process.wait()
+        print("%-10s %9.0f %9.2f %9.2f %7d" % (
+            server, row["rps"], row["p50"], row["p99"], row["errors"]))
+
+
+if __name__ == "__main__":
+    main()
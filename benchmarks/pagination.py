@@ -0,0 +1,64 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from constants import BATCH_SIZE  # noqa: E402
+from google.cloud import datastore  # noqa: E402
+from helpers import chunks  # noqa: E402
+
+# Compares the latency of deep pages fetched by offset and by cursor, e.g.
+#   DATASTORE_EMULATOR_HOST=localhost:8081 python benchmarks/pagination.py
+KIND = "bench_pages"
+
+
+def seed(client, size: int):
+    query = client.query(kind=KIND)
+    query.keys_only()
+    existing = len(list(query.fetch()))
+    entities = []
+    for n in range(existing, size):
+        entity = datastore.Entity(key=client.key(KIND))
+        entity.update({"n": n})
+        entities.append(entity)
+    for batch in chunks(entities, BATCH_SIZE):
+        client.put_multi(batch)
+
+
+def timed_page(query, **kwargs):
+    start = time.perf_counter()
+    iterator = query.fetch(**kwargs)
+    list(next(iterator.pages))
+    return time.perf_counter() - start, iterator.next_page_token
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=10000)
+    parser.add_argument("--limit", type=int, default=5)
+    parser.add_argument("--every", type=int, default=200,
+                        help="report every n-th page")
+    args = parser.parse_args()
+
+    client = datastore.Client()
+    seed(client, args.size)
+    query = client.query(kind=KIND)
+
+    print("page\toffset (ms)\tcursor (ms)")
+    cursor = None
+    for page in range(args.size // args.limit):
+        by_cursor, cursor = timed_page(query, limit=args.limit,
+                                       start_cursor=cursor)
+        if page % args.every == 0:
+            by_offset, _ = timed_page(query, limit=args.limit,
+                                      offset=page * args.limit)
+            print("%d\t%.2f\t%.2f" % (page, by_offset * 1000,
+                                      by_cursor * 1000))
+        if not cursor:
+            break
+
+
+if __name__ == "__main__":
+    main()
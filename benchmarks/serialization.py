@@ -0,0 +1,81 @@
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import serializers  # noqa: E402
+
+from constants import ICEBERGS  # noqa: E402
+from flask import Flask, request  # noqa: E402
+from google.cloud import datastore  # noqa: E402
+
+# Compares CPU time and peak allocations of serializing a large list page by
+# mutating entities and calling json.dumps, against the serializers module
+SHAPES = ["tabular", "dome", "pinnacle", "wedge", "dry-dock", "blocky"]
+
+
+def make_page(size: int) -> list:
+    page = []
+    for n in range(size):
+        iceberg = datastore.Entity(key=datastore.Key(ICEBERGS, n + 1,
+                                                     project="bench"))
+        iceberg.update({"name": "Iceberg %d" % n,
+                        "area": n % 8000,
+                        "shape": SHAPES[n % len(SHAPES)],
+                        "inhabitants": [str(a) for a in range(n % 10)],
+                        "public": True,
+                        "founder": "user%d" % (n % 100)})
+        page.append(iceberg)
+    return page
+
+
+def in_place(page):
+    for i in page:
+        i["id"] = i.id
+        i["self"] = request.url_root + "icebergs/" + str(i.id)
+    return json.dumps({"icebergs": page})
+
+
+def layered(page):
+    return serializers.dumps({"icebergs": serializers.list_output(page)})
+
+
+def measure(serialize, size: int, runs: int):
+    app = Flask(__name__)
+    cpu = []
+    peak = 0
+    for _ in range(runs):
+        page = make_page(size)
+        with app.test_request_context("/icebergs"):
+            tracemalloc.start()
+            start = time.process_time()
+            serialize(page)
+            cpu.append(time.process_time() - start)
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+    return min(cpu), peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[100, 1000, 10000])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    print("encoder: " + ("orjson" if serializers.orjson else "json"))
+    print("%-8s %-10s %10s %12s" % ("size", "path", "cpu ms", "peak KiB"))
+    for size in args.sizes:
+        for name, serialize in (("in place", in_place),
+                                ("layered", layered)):
+            cpu, peak = measure(serialize, size, args.runs)
+            print("%-8d %-10s %10.2f %12.1f" % (size, name, cpu * 1000,
+                                                peak / 1024))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+import copy
+import os
+import pickle
+import threading
+import time
+import uuid
+
+from collections import OrderedDict
+from constants import ANIMALS, ICEBERGS
+
+# "redis" shares entries between every process and instance, "memory" keeps
+# them in the process, or "none" turns the cache off. An in-process cache is
+# only correct while the same process makes every write, such as the
+# development server or the benchmarks: other gunicorn workers and App Engine
+# instances would keep serving an entry for up to CACHE_TTL after a write. So
+# without a shared store the cache is off unless asked for.
+CACHE_BACKEND = os.environ.get(
+    "CACHE_BACKEND", "redis" if "REDIS_URL" in os.environ else "none")
+CACHE_SIZE = int(os.environ.get("CACHE_SIZE", 10000))
+CACHE_TTL = int(os.environ.get("CACHE_TTL", 60))
+
+# Seconds a lookup may take to fill the entries it leased
+LEASE_TTL = 10
+
+# Only these kinds are served from the cache
+CACHED_KINDS = (ANIMALS, ICEBERGS)
+
+
+class MemoryStore:
+    # In-process store with per-entry expiry and LRU eviction once it holds
+    # more than maxsize entries
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._leases = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str):
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._entries[name]
+                return None
+            self._entries.move_to_end(name)
+            return copy.deepcopy(entry[1])
+
+    def set(self, name: str, value, ttl: int):
+        with self._lock:
+            self._set(name, value, ttl)
+
+    def _set(self, name: str, value, ttl: int):
+        self._entries[name] = (time.time() + ttl, copy.deepcopy(value))
+        self._entries.move_to_end(name)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def lease(self, name: str, ttl: int):
+        # Returns the token fill() needs to store a value, or None while
+        # another lookup holds the lease
+        now = time.time()
+        with self._lock:
+            held = self._leases.get(name)
+            if held is not None and held[0] > now:
+                return None
+            token = uuid.uuid4().hex
+            self._leases[name] = (now + ttl, token)
+            return token
+
+    def fill(self, name: str, token: str, value, ttl: int) -> bool:
+        # Stores the value only if the lease was not dropped in the meantime
+        with self._lock:
+            held = self._leases.get(name)
+            if held is None or held[1] != token:
+                return False
+            del self._leases[name]
+            self._set(name, value, ttl)
+            return True
+
+    def delete(self, names):
+        # Drops the entries and any leases on them
+        with self._lock:
+            for name in names:
+                self._entries.pop(name, None)
+                self._leases.pop(name, None)
+
+    def size(self) -> int:
+        return len(self._entries)
+
+
+def redis_client(url: str):
+    # redis is only needed by the "redis" backends of the entity cache and
+    # the rate limiter
+    try:
+        import redis
+    except ImportError:
+        raise ImportError("The redis package is needed with REDIS_URL, "
+                          "CACHE_BACKEND=redis or RATE_LIMIT_BACKEND=redis; "
+                          "pip install redis") from None
+    return redis.Redis.from_url(url)
+
+
+class RedisStore:
+    # Store shared between instances; Redis applies the TTL and its own
+    # maxmemory eviction policy. Leases live next to their entry, and the
+    # check and the store of a fill run as one script
+    FILL = """
+        if redis.call("GET", KEYS[2]) ~= ARGV[1] then
+            return 0
+        end
+        redis.call("DEL", KEYS[2])
+        redis.call("SET", KEYS[1], ARGV[2], "EX", ARGV[3])
+        return 1
+    """
+
+    def __init__(self, url: str):
+        self._redis = redis_client(url)
+        self._fill = self._redis.register_script(self.FILL)
+
+    @property
+    def evictions(self) -> int:
+        return int(self._redis.info("stats").get("evicted_keys", 0))
+
+    def get(self, name: str):
+        value = self._redis.get(name)
+        return None if value is None else pickle.loads(value)
+
+    def set(self, name: str, value, ttl: int):
+        self._redis.set(name, pickle.dumps(value), ex=ttl)
+
+    def lease(self, name: str, ttl: int):
+        token = uuid.uuid4().hex
+        if self._redis.set(name + ":lease", token, nx=True, ex=ttl):
+            return token
+        return None
+
+    def fill(self, name: str, token: str, value, ttl: int) -> bool:
+        return bool(self._fill(keys=[name, name + ":lease"],
+                               args=[token, pickle.dumps(value), ttl]))
+
+    def delete(self, names):
+        if names:
+            self._redis.delete(*names, *[name + ":lease" for name in names])
+
+    def size(self) -> int:
+        return self._redis.dbsize()
+
+
+class NullStore:
+    # Keeps nothing, so every lookup goes to Datastore
+    evictions = 0
+
+    def get(self, name: str):
+        return None
+
+    def lease(self, name: str, ttl: int):
+        return None
+
+    def fill(self, name: str, token: str, value, ttl: int) -> bool:
+        return False
+
+    def delete(self, names):
+        pass
+
+    def size(self) -> int:
+        return 0
+
+
+class EntityCache:
+    def __init__(self, store, ttl: int):
+        self.store = store
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def name(key) -> str:
+        return "entity:" + "/".join(str(part) for part in key.flat_path)
+
+    def get_multi(self, client, keys) -> list:
+        found = []
+        missing = []
+        for key in keys:
+            entity = self.store.get(self.name(key))
+            if entity is None:
+                missing.append(key)
+            else:
+                found.append(entity)
+        self.hits += len(found)
+        self.misses += len(missing)
+
+        if missing:
+            # Entries are only filled under a lease taken before the lookup.
+            # A write drops the lease along with the entry, so a value read
+            # before a write is never cached after it
+            leases = {key: self.store.lease(self.name(key), LEASE_TTL)
+                      for key in missing}
+            for entity in client.get_multi(missing):
+                token = leases.pop(entity.key, None)
+                if token is not None:
+                    self.store.fill(self.name(entity.key), token, entity,
+                                    self.ttl)
+                found.append(entity)
+
+            # Leases on keys that were not found are given back
+            self.store.delete([self.name(key)
+                               for key, token in leases.items() if token])
+        return found
+
+    def invalidate(self, keys):
+        self.store.delete([self.name(key) for key in keys
+                           if not key.is_partial])
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {"backend": type(self.store).__name__,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.store.evictions,
+                "size": self.store.size()}
+
+
+def create_cache() -> EntityCache:
+    if CACHE_BACKEND == "redis":
+        store = RedisStore(os.environ.get("REDIS_URL",
+                                          "redis://localhost:6379/0"))
+    elif CACHE_BACKEND == "none":
+        store = NullStore()
+    else:
+        store = MemoryStore(CACHE_SIZE)
+    return EntityCache(store, CACHE_TTL)
+
+
+entity_cache = create_cache()
+
+
+class CachedClient:
+    # Wraps a datastore.Client so that keyed lookups of Animals and Icebergs
+    # read through the cache and every write invalidates what it touches once
+    # it is made. Lookups inside a transaction always go to Datastore, and
+    # writes made in a transaction are invalidated again once it commits.
+    def __init__(self, client, cache=entity_cache):
+        self._client = client
+        self.cache = cache
+        self._pending = threading.local()
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def get(self, key, **kwargs):
+        found = self.get_multi([key], **kwargs)
+        return found[0] if found else None
+
+    def get_multi(self, keys, **kwargs):
+        if kwargs or self._client.current_transaction is not None:
+            return self._client.get_multi(keys, **kwargs)
+        cached = [key for key in keys if key.kind in CACHED_KINDS]
+        found = self.cache.get_multi(self._client, cached) if cached else []
+        others = [key for key in keys if key.kind not in CACHED_KINDS]
+        if others:
+            found.extend(self._client.get_multi(others))
+        return found
+
+    def put(self, entity, **kwargs):
+        return self.put_multi([entity], **kwargs)
+
+    def put_multi(self, entities, **kwargs):
+        try:
+            return self._client.put_multi(entities, **kwargs)
+        finally:
+            self._invalidate([entity.key for entity in entities])
+
+    def delete(self, key, **kwargs):
+        return self.delete_multi([key], **kwargs)
+
+    def delete_multi(self, keys, **kwargs):
+        try:
+            return self._client.delete_multi(keys, **kwargs)
+        finally:
+            self._invalidate(keys)
+
+    def transaction(self, **kwargs):
+        return CachedTransaction(self, self._client.transaction(**kwargs))
+
+    def _invalidate(self, keys):
+        keys = [key for key in keys if key.kind in CACHED_KINDS]
+        self.cache.invalidate(keys)
+        if self._client.current_transaction is not None:
+            self.pending().extend(keys)
+
+    def pending(self) -> list:
+        if not hasattr(self._pending, "keys"):
+            self._pending.keys = []
+        return self._pending.keys
+
+
+class CachedTransaction:
+    def __init__(self, client, transaction):
+        self._client = client
+        self._transaction = transaction
+
+    def __getattr__(self, name):
+        return getattr(self._transaction, name)
+
+    def __enter__(self):
+        self._transaction.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        try:
+            return self._transaction.__exit__(*exc_info)
+        finally:
+            pending = self._client.pending()
+            self._client.cache.invalidate(pending)
+            del pending[:]
@@ -0,0 +1,47 @@
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+from flask import _request_ctx_stack, current_app, g
+
+# Threads shared by every request of a worker for storage calls and token
+# checks that do not depend on each other; 0 runs them one after another on
+# the request thread, as before
+FETCH_POOL_SIZE = int(os.environ.get("FETCH_POOL_SIZE", 8))
+
+# Threads are only started on first use, so a pool created before the server
+# forks its workers is still safe to use in each of them
+executor = None
+if FETCH_POOL_SIZE > 0:
+    executor = ThreadPoolExecutor(max_workers=FETCH_POOL_SIZE,
+                                  thread_name_prefix="fetch")
+
+
+def _call_in_context(app, shared_g, request_ctx, call):
+    # Calls see the same request and the same g as the request thread, so
+    # storage stats and loaded relations are shared with it. The request
+    # context is only placed on this thread's stack rather than pushed, as
+    # popping a pushed one would run the teardown_request handlers, such as
+    # the release of the request's admission slot, while it is still served
+    with app.app_context() as app_ctx:
+        app_ctx.g = shared_g
+        _request_ctx_stack.push(request_ctx)
+        try:
+            return call()
+        finally:
+            _request_ctx_stack.pop()
+
+
+def gather(*calls) -> list:
+    # Runs each call concurrently and returns their results in order; the
+    # first call runs on the request thread while the others are in the pool
+    if executor is None or len(calls) < 2:
+        return [call() for call in calls]
+
+    app = current_app._get_current_object()
+    shared_g = g._get_current_object()
+    request_ctx = _request_ctx_stack.top
+    futures = [executor.submit(_call_in_context, app, shared_g, request_ctx,
+                               call)
+               for call in calls[1:]]
+    first = calls[0]()
+    return [first] + [future.result() for future in futures]
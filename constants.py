@@ -3,6 +3,27 @@ ICEBERGS = "icebergs"
 ANIMALS = "animals"
 USERS = "users"
 
+# Attributes that can be selected with ?fields= on list endpoints
+ICEBERG_FIELDS = ("id", "name", "area", "shape", "inhabitants", "public",
+                  "founder", "self")
+ANIMAL_FIELDS = ("id", "name", "species", "height", "home", "self")
+
+# Attributes that list endpoints can be sorted by with ?order=
+ICEBERG_ORDERS = ("name", "area", "shape")
+ANIMAL_ORDERS = ("name", "species", "height")
+
+# Properties holding lists, which projection queries return once per value
+LIST_PROPERTIES = ("inhabitants",)
+
+# Name reservations that keep Animal/Iceberg names unique
+NAMES = "names"
+
+# Sharded counters behind /stats
+STATS = "stats"
+
+# Most mutations Datastore accepts in a single commit
+BATCH_SIZE = 500
+
 # Client identification
 CLIENT_ID = r".apps.googleusercontent.com"
 CLIENT_SECRET = r""
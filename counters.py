@@ -0,0 +1,70 @@
+import os
+import random
+
+from collections import Counter
+from constants import ANIMALS, ICEBERGS, STATS
+from google.cloud import datastore
+
+# Aggregate statistics are kept as counters spread over STATS_SHARDS entities,
+# so concurrent writes rarely touch the same shard and a read is one lookup of
+# every shard. Each write moves a random shard by the difference between the
+# stored and the new version of what it changes, inside the transaction that
+# writes it. Run `python migrations.py stats` after changing STATS_SHARDS.
+STATS_SHARDS = int(os.environ.get("STATS_SHARDS", 20))
+
+
+def shard_keys(client) -> list:
+    return [client.key(STATS, "shard-%d" % n) for n in range(STATS_SHARDS)]
+
+
+def counts(entity) -> Counter:
+    # The counters an Animal or Iceberg contributes to
+    if entity is None:
+        return Counter()
+    if entity.kind == ICEBERGS:
+        return Counter({"icebergs": 1, "area": entity["area"],
+                        "shape:" + entity["shape"]: 1})
+    if entity.kind == ANIMALS:
+        return Counter({"animals": 1, "species:" + entity["species"]: 1})
+    return Counter()
+
+
+def shard_entity(key, totals) -> datastore.Entity:
+    shard = datastore.Entity(key=key, exclude_from_indexes=tuple(totals))
+    shard.update(totals)
+    return shard
+
+
+def record(client, changes, stored=None) -> dict:
+    # changes are (key, entity) pairs, with None for a deleted entity. Unless
+    # the caller already read them in this transaction, the stored versions
+    # are read together with the shard, so this must run before the entities
+    # themselves are written. Returns the stored versions by key
+    shard_key = random.choice(shard_keys(client))
+    keys = [shard_key]
+    if stored is None:
+        keys.extend(key for key, _ in changes)
+    found = {entity.key: entity for entity in client.get_multi(keys)}
+    found.update(stored or {})
+    shard = found.pop(shard_key, None)
+
+    delta = Counter()
+    for key, entity in changes:
+        delta.update(counts(entity))
+        delta.subtract(counts(found.get(key)))
+    if not any(delta.values()):
+        return found
+
+    totals = Counter(shard or {})
+    totals.update(delta)
+    client.put(shard_entity(shard_key, {name: value
+                                        for name, value in totals.items()
+                                        if value}))
+    return found
+
+
+def read_totals(client) -> Counter:
+    totals = Counter()
+    for shard in client.get_multi(shard_keys(client)):
+        totals.update(shard)
+    return totals
@@ -12,7 +12,22 @@ INVALID_SPECIES = "The species of an Animal can only consist of up to 50 "\
                   "alphanumeric characters"
 
 # Other bad requests
+INVALID_ANIMAL_IDS = "The request object must include a list of up to 499 "\
+                     "animal_ids"
+INVALID_BATCH = "The request body must be an array of objects"
+INVALID_FIELDS = "The fields must be a comma-separated list of the "\
+                 "attributes of this resource"
+INVALID_FILTER = "The shape and species filters must be valid values and "\
+                 "the min_ and max_ filters must be int values"
+INVALID_IMPORT = "Each line must be a JSON object with a kind of icebergs, "\
+                 "animals, or users, a key, and properties"
+INVALID_KINDS = "The kinds can only be icebergs, animals, or users"
 ANIMAL_ASSIGNED = "This Animal already has a home"
+INVALID_ORDER = "The order must be a sortable attribute, prefixed with - "\
+                "to sort descending, and the attribute of any min_ or max_ "\
+                "filter"
+INVALID_PAGE = "The limit must be an int value and the cursor must come "\
+               "from a previous page"
 INVALID_PUBLIC = "The public attribute must be True or False"
 INVALID_SHAPE = "The shape of an Iceberg can only be of the following: "\
                 "tabular, dome, pinnacle, wedge, dry-dock, or blocky"
@@ -39,5 +54,17 @@ METHOD_INVALID = "This method is not allowed"
 # 406 Not Acceptable
 WRONG_MEDIA_REQUESTED = "The requested media type is not offered"
 
+# 412 Precondition Failed
+PRECONDITION_FAILED = "This resource has changed since the version given in "\
+                      "If-Match"
+
 # 415 Unsupported Media Type
 WRONG_MEDIA_RECEIVED = "The received media type is not supported"
+
+# 429 Too Many Requests
+RATE_LIMITED = "Too many requests; retry after the number of seconds in "\
+               "Retry-After"
+
+# 503 Service Unavailable
+OVERLOADED = "The service is busy; retry after the number of seconds in "\
+             "Retry-After"
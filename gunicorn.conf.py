@@ -0,0 +1,30 @@
+import os
+import tempfile
+
+# Run with: gunicorn -c gunicorn.conf.py wsgi:app
+# The app is imported once before the workers are forked. Connections to
+# Datastore and Redis, and the fetch pool's threads, are only opened on first
+# use, so every worker gets its own.
+bind = "0.0.0.0:" + os.environ.get("PORT", "8081")
+preload_app = True
+
+# Threaded workers serve several requests per process, and each request
+# spreads its independent storage calls over concurrency.FETCH_POOL_SIZE
+# more threads. ratelimit.MAX_IN_FLIGHT defaults to three quarters of the
+# threads, so the rest can answer 503 while they are all busy
+worker_class = "gthread"
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+threads = int(os.environ.get("THREADS", 8))
+timeout = 60
+
+# Each worker keeps its own metrics and writes them to METRICS_DIR, so that
+# /metrics on any worker reports all of them. A fresh directory on every
+# start keeps the totals of an earlier run out of it
+if workers > 1:
+    os.environ.setdefault("METRICS_DIR",
+                          tempfile.mkdtemp(prefix="arctic-metrics-"))
+
+
+def child_exit(server, worker):
+    import metrics
+    metrics.mark_process_dead(worker.pid)
@@ -1,46 +1,290 @@
-from constants import ANIMALS, CLIENT_ID, ICEBERGS
-from flask import jsonify, make_response, request
-from google.auth.transport import requests
-from google.oauth2 import id_token
-
-
-def animal_output(animal, client):
-    if animal["home"] is not None:
-        iceberg_key = client.key(ICEBERGS, int(animal["home"]))
-        animal_home = client.get(key=iceberg_key)
-        home_id = str(animal["home"])
-        home_info = {"id": home_id,
-                     "name": animal_home["name"],
-                     "self": (request.url_root + "icebergs/" + home_id)}
+import hashlib
+import json
+import os
+import zlib
+
+from constants import ANIMALS, ICEBERGS, LIST_PROPERTIES
+from flask import g, jsonify, make_response, request
+from google.api_core.exceptions import BadRequest
+from tokens import verify_token
+from urllib.parse import urlencode
+
+# brotli is optional; clients are offered gzip without it
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Smaller bodies are sent as they are; levels trade CPU for size, gzip from
+# 1 to 9 and brotli from 0 to 11
+COMPRESS_MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", 1024))
+COMPRESS_LEVEL = int(os.environ.get("COMPRESS_LEVEL", 6))
+BROTLI_QUALITY = int(os.environ.get("BROTLI_QUALITY", 4))
+
+# Content-codings bodies may be sent in
+ENCODINGS = ("gzip", "br")
+
+
+def related_keys(entity, client) -> list:
+    if entity.kind == ANIMALS and entity.get("home") is not None:
+        return [client.key(ICEBERGS, int(entity["home"]))]
+    if entity.kind == ICEBERGS and entity.get("inhabitants"):
+        return [client.key(ANIMALS, int(animal_id))
+                for animal_id in entity["inhabitants"]]
+    return []
+
+
+def existing_homes(animals, client, iceberg) -> set:
+    # IDs of the Icebergs the Animals live on that still exist, looked up
+    # together; an Animal whose Iceberg was deleted without it is free to
+    # move again. iceberg is one the caller already read
+    homes = {animal["home"] for animal in animals
+             if animal["home"] is not None}
+    missing = [client.key(ICEBERGS, int(home))
+               for home in homes - {str(iceberg.id)}]
+    found = homes & {str(iceberg.id)}
+    if missing:
+        found.update(str(entity.id) for entity in client.get_multi(missing))
+    return found
+
+
+def load_relations(entities, client) -> dict:
+    # Relations are remembered for the rest of the request, and every key the
+    # serializers still need is resolved with a single get_multi
+    relations = g.setdefault("relations", {})
+    keys = [key for entity in entities for key in related_keys(entity, client)]
+    missing = list({key for key in keys if key not in relations})
+
+    if missing:
+        for related in client.get_multi(missing):
+            relations[related.key] = related
+        for key in missing:
+            relations.setdefault(key, None)
+    return relations
+
+
+def remember_relations(*entities):
+    # Entities already in hand do not need to be fetched again
+    relations = g.setdefault("relations", {})
+    for entity in entities:
+        relations[entity.key] = entity
+
+
+def url_root() -> str:
+    # request.url_root is rebuilt from the environ on every access
+    if "url_root" not in g:
+        g.url_root = request.url_root
+    return g.url_root
+
+
+def content_hash(entities, extra="") -> str:
+    digest = hashlib.sha1(extra.encode("utf-8"))
+    for entity in entities:
+        if entity is None:
+            continue
+        digest.update(repr(entity.key.flat_path).encode("utf-8"))
+        digest.update(json.dumps(entity, sort_keys=True,
+                                 default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def resource_etag(entity, client) -> str:
+    # Strong ETag over an entity and every relation in its representation,
+    # whose links are absolute URLs under the host the request came to
+    relations = load_relations([entity], client)
+    related = [relations[key] for key in related_keys(entity, client)]
+    return content_hash([entity] + related, url_root())
+
+
+def page_etag(results, next_url) -> str:
+    # The same entities selected with different fields are different pages
+    return content_hash(results, url_root() + request.full_path
+                        + (next_url or ""))
+
+
+def etag_variants(etag: str) -> list:
+    # The ETag of a body and those of its compressed encodings, which
+    # compress_response sets
+    return [etag] + [etag + "-" + encoding for encoding in ENCODINGS]
+
+
+def etag_matches(tags, etag: str) -> bool:
+    # Whether If-Match or If-None-Match names this version in any encoding
+    return any(tags.contains(tag) for tag in etag_variants(etag))
+
+
+def changed_since(current, client) -> bool:
+    # Compares If-Match with the entity as read in the current transaction
+    if not request.if_match:
+        return False
+    return not etag_matches(request.if_match, resource_etag(current, client))
+
+
+def chunks(items, size: int):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def fetch_page(query):
+    # Pages are addressed by opaque cursors; offsets are still accepted for
+    # older clients but make Datastore walk every skipped entity
+    q_limit = int(request.args.get("limit", 5))
+    cursor = request.args.get("cursor")
+    try:
+        if cursor is None and "offset" in request.args:
+            q_offset = int(request.args["offset"])
+            iterator = query.fetch(limit=q_limit, offset=q_offset)
+        else:
+            iterator = query.fetch(limit=q_limit, start_cursor=cursor)
+        results = list(next(iterator.pages))
+    except BadRequest as e:
+        raise ValueError(e)
+
+    next_url = None
+    if iterator.next_page_token:
+        token = iterator.next_page_token
+        if isinstance(token, bytes):
+            token = token.decode("ascii")
+        args = request.args.to_dict()
+        args.pop("offset", None)
+        args.update({"limit": q_limit, "cursor": token})
+        next_url = request.base_url + "?" + urlencode(args)
+    return results, next_url
+
+
+def add_filters(query, equals, ranges) -> bool:
+    # ?<prop>= equality filters, whose value is parsed into the one stored by
+    # the function in equals, and ?min_<prop>= and ?max_<prop>= int ranges;
+    # False for an invalid value
+    for prop, parse in equals.items():
+        if prop in request.args:
+            try:
+                query.add_filter(prop, "=", parse(request.args[prop]))
+            except ValueError:
+                return False
+    for prop in ranges:
+        for param, op in (("min_" + prop, ">="), ("max_" + prop, "<=")):
+            if param in request.args:
+                try:
+                    query.add_filter(prop, op, int(request.args[param]))
+                except ValueError:
+                    return False
+    return True
+
+
+def add_order(query, orders) -> bool:
+    # ?order=<prop>, or ?order=-<prop> to sort descending. Datastore sorts by
+    # the property of an inequality filter first, so no other order can be
+    # combined with one; False for an order that is not supported
+    if "order" not in request.args:
+        return True
+    order = request.args["order"]
+    prop = order[1:] if order.startswith("-") else order
+    ranged = {p for p, op, _ in query.filters if op != "="}
+    if prop not in orders or ranged - {prop}:
+        return False
+
+    # Results all share the value of an equality filter
+    if (prop, "=") not in {(p, op) for p, op, _ in query.filters}:
+        query.order = [order]
+    return True
+
+
+def requested_fields(allowed) -> list:
+    # ?fields=id,name selects the attributes of each result; None selects all
+    if "fields" not in request.args:
+        return None
+    fields = []
+    for field in request.args["fields"].split(","):
+        field = field.strip()
+        if field not in allowed:
+            raise ValueError(field)
+        if field not in fields:
+            fields.append(field)
+    return fields
+
+
+def project_fields(query, fields, indexed=()) -> dict:
+    # Only the selected properties are read: keys-only when id and self are
+    # all that is needed, otherwise a projection. Datastore cannot project a
+    # property with an equality filter, so those values are returned from the
+    # filters instead, and list properties still need whole entities.
+    # Projecting also needs an index on the equality-filtered properties and
+    # the projected ones. index.yaml declares one for each property in
+    # indexed, so only a single such property is projected, and only when
+    # nothing else sorts the query; other selections read whole entities,
+    # which list_output trims
+    if fields is None:
+        return {}
+    fixed = {prop: value for prop, op, value in query.filters if op == "="}
+    props = [field for field in fields
+             if field not in ("id", "self") and field not in fixed]
+    if not props:
+        query.keys_only()
+    elif len(props) == 1 and props[0] not in LIST_PROPERTIES:
+        ranged = {prop for prop, op, _ in query.filters if op != "="}
+        ordered = {prop.lstrip("-") for prop in query.order}
+        if (ranged | ordered) <= set(props) and (
+                not fixed or props[0] in indexed):
+            query.projection = props
+    return fixed
+
+
+def accepted_encoding():
+    # br when brotli is installed and the client takes it, otherwise gzip
+    if brotli is not None and request.accept_encodings["br"]:
+        return "br"
+    if request.accept_encodings["gzip"]:
+        return "gzip"
+    return None
+
+
+def compress_chunks(chunks, encoding: str):
+    # Compresses a body piece by piece, so streamed bodies stay streamed
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        compress, finish = compressor.process, compressor.finish
+    else:
+        # wbits of 31 writes a gzip header and trailer
+        compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31)
+        compress, finish = compressor.compress, compressor.flush
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            data = compress(chunk)
+            if data:
+                yield data
+        yield finish()
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
+def compress_response(response):
+    # Bodies are compressed for clients that accept it, once they are big
+    # enough to be worth it. A compressed body is a different representation,
+    # so its ETag is that of the uncompressed body with the content-coding
+    # appended; see etag_matches
+    response.vary.add("Accept-Encoding")
+    encoding = accepted_encoding()
+    if (encoding is None or response.status_code in (204, 304)
+            or "Content-Encoding" in response.headers):
+        return response
+
+    if response.is_streamed:
+        response.response = compress_chunks(response.response, encoding)
     else:
-        home_info = animal["home"]
-    return {"id": str(animal.id),
-            "name": animal["name"],
-            "species": animal["species"],
-            "height": animal["height"],
-            "home": home_info,
-            "self": request.url_root + "animals/" + str(animal.id)}
-
-
-def iceberg_output(iceberg, client):
-    inhabitants = []
-    if iceberg["inhabitants"] is not None:
-        for animal_key in iceberg["inhabitants"]:
-            this_key = client.key(ANIMALS, int(animal_key))
-            this_animal = client.get(key=this_key)
-            animal_id = str(this_animal.id)
-            result = {"id": animal_id,
-                      "name": this_animal["name"],
-                      "self": (request.url_root + "animals/" + animal_id)}
-            inhabitants.append(result)
-    return {"id": str(iceberg.id),
-            "name": iceberg["name"],
-            "area": iceberg["area"],
-            "shape": iceberg["shape"],
-            "inhabitants": inhabitants,
-            "public": iceberg["public"],
-            "founder": iceberg["founder"],
-            "self": request.url_root + "icebergs/" + str(iceberg.id)}
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_SIZE:
+            return response
+        response.set_data(b"".join(compress_chunks([data], encoding)))
+    response.headers["Content-Encoding"] = encoding
+    etag, weak = response.get_etag()
+    if etag is not None and not weak:
+        response.set_etag(etag + "-" + encoding)
+    return response
 
 
 def status_fail(code, msg, header=None):
@@ -55,9 +299,15 @@ def status_fail(code, msg, header=None):
 
 
 def status_success(code, output=None, mime="application/json",
-                   location=None, page=None):
+                   location=None, page=None, etag=None):
     response = make_response() if output is None else make_response(output)
 
+    if code == 304 and etag is not None:
+        # Not Modified repeats the ETag of the encoding the client has
+        etag = next((tag for tag in etag_variants(etag)
+                     if request.if_none_match.contains(tag)), etag)
+    if etag is not None:
+        response.set_etag(etag)
     if location is not None:
         response.headers.set("Location", location)
     if page is not None:
@@ -66,7 +316,7 @@ def status_success(code, output=None, mime="application/json",
     response.headers.set("Content-Type", mime)
     response.mimetype = mime
     response.status_code = code
-    return response
+    return compress_response(response)
 
 
 def valid_alphanum(val: str, range: int) -> bool:
@@ -86,12 +336,28 @@ def valid_shape(val: str) -> bool:
     return val.lower() in shapes
 
 
+def parse_shape(val: str) -> str:
+    # Shapes are accepted in any case and stored in lower case
+    if not valid_shape(val):
+        raise ValueError(val)
+    return val.lower()
+
+
+def parse_species(val: str) -> str:
+    if not valid_alphanum(val, 50):
+        raise ValueError(val)
+    return val
+
+
 def verify_jwt() -> str:
+    # The token is verified once and remembered for the rest of the request
+    if "jwt_user" in g:
+        return g.jwt_user
     try:
         # 7:: because jwt begins with "Bearer\n"
         jwt = str(request.headers["Authorization"])[7::]
-        req = requests.Request()
-        id_info = id_token.verify_oauth2_token(jwt, req, CLIENT_ID)
-        return str(id_info["sub"])
+        id_info = verify_token(jwt)
+        g.jwt_user = str(id_info["sub"])
     except (KeyError, ValueError):
-        return "Error"
+        g.jwt_user = "Error"
+    return g.jwt_user
@@ -1,29 +1,49 @@
+import metrics
+import models.admin
 import models.animals
 import models.icebergs
+import models.stats
 import models.users
+import ratelimit
 
-from constants import CLIENT_ID, CLIENT_SECRET, REDIRECT_URI, SCOPE, USERS
-from flask import Flask, render_template, request
-from google.auth.transport import requests
-from google.cloud import datastore
-from google.oauth2 import id_token
+from cache import entity_cache
+from constants import CLIENT_ID, CLIENT_SECRET, REDIRECT_URI, SCOPE
+from flask import Blueprint, Flask, render_template, request
+from helpers import status_success
+from models.users import get_or_create_user
 from requests_oauthlib import OAuth2Session
+from serializers import HTML_TEMPLATES, dumps
+from tokens import verify_token
 
 
 # This disables the requirement to use HTTPS so that you can test locally.
 import os
 os.environ["OAUTHLIB_INSECURE_TRANSPORT"] = '1'
 
-app = Flask(__name__)
-app.register_blueprint(models.animals.bp)
-app.register_blueprint(models.icebergs.bp)
-app.register_blueprint(models.users.bp)
-
-client = datastore.Client()
+bp = Blueprint("main", __name__)
 oauth = OAuth2Session(CLIENT_ID, redirect_uri=REDIRECT_URI, scope=SCOPE)
 
 
-@app.route('/')
+def create_app():
+    # The Datastore client is shared by every blueprint and is only created
+    # on first use; see storage.get_client
+    app = Flask(__name__)
+    metrics.init_app(app)
+    ratelimit.init_app(app)
+    app.register_blueprint(bp)
+    app.register_blueprint(models.admin.bp)
+    app.register_blueprint(models.animals.bp)
+    app.register_blueprint(models.icebergs.bp)
+    app.register_blueprint(models.stats.bp)
+    app.register_blueprint(models.users.bp)
+
+    # Compile the HTML views up front rather than on their first request
+    for template in HTML_TEMPLATES:
+        app.jinja_env.get_template(template)
+    return app
+
+
+@bp.route('/')
 def index():
     authorization_url, state = oauth.authorization_url(
         "https://accounts.google.com/o/oauth2/auth",
@@ -33,7 +53,7 @@ def index():
 
 
 # Users are redirected here and JWT is collected for future requests
-@app.route("/oauth")
+@bp.route("/oauth")
 def oauthroute():
     token = oauth.fetch_token(
         "https://accounts.google.com/o/oauth2/token",
@@ -42,29 +62,33 @@ def oauthroute():
 
     # User information
     jwt = token["id_token"]
-    req = requests.Request()
-    id_info = id_token.verify_oauth2_token(jwt, req, CLIENT_ID)
+    id_info = verify_token(jwt)
     user_id = id_info["sub"]
 
-    query = client.query(kind=USERS)
-    results = list(query.fetch())
-
-    # Search for User
-    user_exists = False
-    for u in results:
-        if u["id"] == user_id:
-            user_exists = True
-            break
-
-    # Update User
-    if not user_exists:
-        user = datastore.Entity(key=client.key(USERS))
-        user.update({"id": user_id})
-        client.put(user)
+    # Create User on first login
+    get_or_create_user(user_id)
 
     return render_template("/views/user.html",
                            user_id=user_id, user_jwt=jwt)
 
 
+# Hit rate and evictions of the Animal/Iceberg entity cache
+@bp.route("/metrics/cache")
+def cache_metrics():
+    return status_success(200, output=dumps(entity_cache.stats()))
+
+
+# Per-route latency and storage usage in the Prometheus text format
+@bp.route("/metrics")
+def prometheus_metrics():
+    return status_success(200, output=metrics.registry.render(),
+                          mime="text/plain; version=0.0.4")
+
+
+app = create_app()
+
+
+# Development server only; see wsgi.py for production
 if __name__ == "__main__":
-    app.run(host="127.0.0.1", port=8081, debug=True)
+    app.run(host="127.0.0.1", port=int(os.environ.get("PORT", 8081)),
+            debug=True)
@@ -0,0 +1,283 @@
+import base64
+import bisect
+import copy
+import itertools
+import json
+import os
+import threading
+import time
+
+from google.cloud import datastore
+
+# Properties with secondary indexes, kept as sorted lists of key ids per value
+INDEXED = ("founder", "public", "home", "name", "shape", "species")
+
+# Simulated round trip added to every call that would be an RPC
+STORAGE_LATENCY_MS = float(os.environ.get("STORAGE_LATENCY_MS", 0))
+
+OPERATORS = {"=": lambda a, b: a == b,
+             "<": lambda a, b: a < b,
+             "<=": lambda a, b: a <= b,
+             ">": lambda a, b: a > b,
+             ">=": lambda a, b: a >= b}
+
+
+def id_of(key) -> tuple:
+    # Datastore orders numeric IDs before names
+    return (0, key.id) if key.id is not None else (1, key.name)
+
+
+def encode_cursor(value) -> str:
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode()
+
+
+def decode_cursor(cursor):
+    if isinstance(cursor, bytes):
+        cursor = cursor.decode()
+    return json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+
+
+class MemoryClient:
+    # In-memory engine exposing the subset of datastore.Client used by the
+    # blueprints: keys, get/get_multi, put/put_multi, delete/delete_multi,
+    # allocate_ids, filtered and ordered queries with limit/offset/cursor, and
+    # transactions. Transactions are serialized, so they never conflict.
+    def __init__(self, project="local", latency_ms=STORAGE_LATENCY_MS):
+        self.project = project
+        self.latency = latency_ms / 1000
+        self._entities = {}
+        self._ids = {}
+        self._indexes = {}
+        self._last_id = 0
+        self._lock = threading.RLock()
+        self._local = threading.local()
+
+    def _rpc(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    @property
+    def current_transaction(self):
+        return getattr(self._local, "transaction", None)
+
+    def key(self, *path_args, **kwargs):
+        kwargs.setdefault("project", self.project)
+        return datastore.Key(*path_args, **kwargs)
+
+    def query(self, **kwargs):
+        return MemoryQuery(self, **kwargs)
+
+    def transaction(self, **kwargs):
+        return MemoryTransaction(self)
+
+    def allocate_ids(self, incomplete_key, num_ids: int) -> list:
+        self._rpc()
+        with self._lock:
+            return [incomplete_key.completed_key(self._new_id())
+                    for _ in range(num_ids)]
+
+    def get(self, key, **kwargs):
+        found = self.get_multi([key], **kwargs)
+        return found[0] if found else None
+
+    def get_multi(self, keys, **kwargs) -> list:
+        self._rpc()
+        with self._lock:
+            found = (self._entities.get(key.flat_path) for key in keys)
+            return [copy.deepcopy(entity) for entity in found
+                    if entity is not None]
+
+    def put(self, entity, **kwargs):
+        self.put_multi([entity])
+
+    def put_multi(self, entities, **kwargs):
+        if self.current_transaction is None:
+            self._rpc()
+        with self._lock:
+            for entity in entities:
+                if entity.key.is_partial:
+                    entity.key = entity.key.completed_key(self._new_id())
+                self._write(entity.key, copy.deepcopy(entity))
+
+    def delete(self, key, **kwargs):
+        self.delete_multi([key])
+
+    def delete_multi(self, keys, **kwargs):
+        if self.current_transaction is None:
+            self._rpc()
+        with self._lock:
+            for key in keys:
+                self._write(key, None)
+
+    def _new_id(self) -> int:
+        self._last_id += 1
+        return self._last_id
+
+    def _write(self, key, entity):
+        # IDs are only ever handed out above every ID stored, including
+        # those of entities written with complete keys
+        if entity is not None and key.id is not None:
+            self._last_id = max(self._last_id, key.id)
+        transaction = self.current_transaction
+        old = self._entities.get(key.flat_path)
+        if transaction is not None:
+            transaction.undo.append((key, old))
+
+        ids = self._ids.setdefault(key.kind, [])
+        indexes = self._indexes.setdefault(key.kind, {})
+        if old is not None:
+            del self._entities[key.flat_path]
+            ids.pop(bisect.bisect_left(ids, id_of(key)))
+            for prop in INDEXED:
+                if prop in old:
+                    values = indexes[prop][old[prop]]
+                    values.pop(bisect.bisect_left(values, id_of(key)))
+        if entity is not None:
+            self._entities[key.flat_path] = entity
+            bisect.insort(ids, id_of(key))
+            for prop in INDEXED:
+                if prop in entity:
+                    values = indexes.setdefault(prop, {})
+                    bisect.insort(values.setdefault(entity[prop], []),
+                                  id_of(key))
+
+    def _matches(self, query, after=None):
+        # Yields (key id, entity) in key order, walking the smallest index
+        # that covers one of the equality filters
+        with self._lock:
+            ids = self._ids.get(query.kind, [])
+            indexes = self._indexes.get(query.kind, {})
+            for prop, op, value in query.filters:
+                if op == "=" and prop in INDEXED:
+                    candidates = indexes.get(prop, {}).get(value, [])
+                    if len(candidates) < len(ids):
+                        ids = candidates
+            position = 0 if after is None else bisect.bisect_right(ids, after)
+
+        while position < len(ids):
+            id_ = ids[position]
+            position += 1
+            path = (query.kind, id_[1])
+            entity = self._entities.get(path)
+            if entity is not None and query.matches(entity):
+                yield id_, entity
+
+
+class MemoryQuery:
+    def __init__(self, client, kind=None, filters=(), projection=(),
+                 order=(), **kwargs):
+        self._client = client
+        self.kind = kind
+        self.filters = list(filters)
+        self.projection = list(projection)
+        self.order = list(order)
+
+    def add_filter(self, property_name, operator, value):
+        self.filters.append((property_name, operator, value))
+        return self
+
+    def keys_only(self):
+        self.projection = ["__key__"]
+
+    def matches(self, entity) -> bool:
+        for prop, op, value in self.filters:
+            if prop not in entity:
+                return False
+            found = entity[prop]
+            found = found if isinstance(found, list) else [found]
+            try:
+                if not any(OPERATORS[op](f, value) for f in found):
+                    return False
+            except TypeError:
+                return False
+        return True
+
+    def fetch(self, limit=None, offset=0, start_cursor=None, **kwargs):
+        return MemoryIterator(self, limit, offset, start_cursor)
+
+    def results(self, offset: int, start_cursor):
+        # Yields (cursor, entity); cursors are the last key id in key order,
+        # or the number of results already returned for other orders
+        cursor = decode_cursor(start_cursor) if start_cursor else None
+        if not self.order:
+            after = tuple(cursor) if cursor is not None else None
+            matches = self._client._matches(self, after)
+            return itertools.islice(matches, offset, None)
+
+        matches = [entity for _, entity in self._client._matches(self)]
+        for prop in reversed(self.order):
+            matches.sort(key=lambda e: sort_value(e, prop.lstrip("-")),
+                         reverse=prop.startswith("-"))
+        start = (cursor or 0) + offset
+        return ((n + 1, entity)
+                for n, entity in enumerate(matches[start:], start))
+
+    def shape(self, entity):
+        if not self.projection:
+            return copy.deepcopy(entity)
+        shaped = datastore.Entity(key=copy.deepcopy(entity.key))
+        for prop in self.projection:
+            if prop != "__key__" and prop in entity:
+                shaped[prop] = copy.deepcopy(entity[prop])
+        return shaped
+
+
+def sort_value(entity, prop):
+    # None sorts before every other value, as in Datastore
+    value = entity.get(prop)
+    return (value is not None, value)
+
+
+class MemoryIterator:
+    def __init__(self, query, limit, offset, start_cursor):
+        self._query = query
+        self._limit = limit
+        self._offset = offset or 0
+        self._start_cursor = start_cursor
+        self.next_page_token = None
+
+    def __iter__(self):
+        return iter(self._page())
+
+    @property
+    def pages(self):
+        yield self._page()
+
+    def _page(self) -> list:
+        self._query._client._rpc()
+        results = self._query.results(self._offset, self._start_cursor)
+        page = list(itertools.islice(results, self._limit))
+        if self._limit is not None and page and next(results, None):
+            self.next_page_token = encode_cursor(page[-1][0])
+        return [self._query.shape(entity) for _, entity in page]
+
+
+class MemoryTransaction:
+    # Holds the engine lock from begin to commit and undoes every write if
+    # the block raises
+    def __init__(self, client):
+        self._client = client
+        self.undo = []
+
+    def __enter__(self):
+        # BeginTransaction
+        self._client._rpc()
+        self._client._lock.acquire()
+        self._client._local.transaction = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            # Rollback or Commit
+            if exc_type is not None:
+                self.rollback()
+            self._client._rpc()
+        finally:
+            self._client._local.transaction = None
+            self._client._lock.release()
+
+    def rollback(self):
+        self._client._local.transaction = None
+        for key, entity in reversed(self.undo):
+            self._client._write(key, entity)
+        self.undo = []
@@ -0,0 +1,369 @@
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+
+from cache import entity_cache
+from flask import g, has_app_context, request
+from ratelimit import limiter
+from tokens import token_cache
+
+# Histogram buckets for request durations (seconds) and storage calls
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+CALL_BUCKETS = (0, 1, 2, 3, 4, 5, 10, 25, 50, 100)
+
+OPERATIONS = ("get", "put", "delete", "query", "allocate_ids", "commit")
+
+# Every process keeps its own metrics. With several gunicorn workers, each
+# writes them to a file in METRICS_DIR at most every METRICS_FLUSH seconds,
+# and /metrics adds up the files of every worker, whichever one serves the
+# scrape; see gunicorn.conf.py. Without METRICS_DIR, /metrics only reports
+# the process that serves it.
+METRICS_DIR = os.environ.get("METRICS_DIR")
+METRICS_FLUSH = float(os.environ.get("METRICS_FLUSH", 1))
+
+
+class RequestStats:
+    # Storage calls, entities read or written, and time spent per operation
+    # during one request
+    def __init__(self):
+        self.operations = {}
+        self._lock = threading.Lock()
+
+    def record(self, operation: str, seconds: float, entities=0):
+        with self._lock:
+            totals = self.operations.setdefault(operation, [0, 0, 0.0])
+            totals[0] += 1
+            totals[1] += entities
+            totals[2] += seconds
+
+    def calls(self) -> int:
+        return sum(totals[0] for totals in self.operations.values())
+
+
+def current_stats():
+    if has_app_context():
+        return g.get("storage_stats")
+    return None
+
+
+def timed(operation: str, call, *args, **kwargs):
+    start = time.perf_counter()
+    result = call(*args, **kwargs)
+    stats = current_stats()
+    if stats is not None:
+        entities = 0
+        if operation == "get":
+            entities = len(result)
+        elif operation in ("put", "delete"):
+            entities = len(args[0])
+        stats.record(operation, time.perf_counter() - start, entities)
+    return result
+
+
+class InstrumentedClient:
+    # Wraps a storage client and attributes every call to the current request
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def get(self, key, **kwargs):
+        found = self.get_multi([key], **kwargs)
+        return found[0] if found else None
+
+    def get_multi(self, keys, **kwargs):
+        return timed("get", self._client.get_multi, keys, **kwargs)
+
+    def put(self, entity, **kwargs):
+        return self.put_multi([entity], **kwargs)
+
+    def put_multi(self, entities, **kwargs):
+        return timed("put", self._client.put_multi, entities, **kwargs)
+
+    def delete(self, key, **kwargs):
+        return self.delete_multi([key], **kwargs)
+
+    def delete_multi(self, keys, **kwargs):
+        return timed("delete", self._client.delete_multi, keys, **kwargs)
+
+    def allocate_ids(self, incomplete_key, num_ids, **kwargs):
+        return timed("allocate_ids", self._client.allocate_ids,
+                     incomplete_key, num_ids, **kwargs)
+
+    def query(self, **kwargs):
+        return InstrumentedQuery(self._client.query(**kwargs))
+
+    def transaction(self, **kwargs):
+        return InstrumentedTransaction(self._client.transaction(**kwargs))
+
+
+class InstrumentedQuery:
+    def __init__(self, query):
+        object.__setattr__(self, "_query", query)
+
+    def __getattr__(self, name):
+        return getattr(self._query, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._query, name, value)
+
+    def add_filter(self, *args, **kwargs):
+        self._query.add_filter(*args, **kwargs)
+        return self
+
+    def keys_only(self):
+        self._query.keys_only()
+
+    def fetch(self, *args, **kwargs):
+        return InstrumentedIterator(self._query.fetch(*args, **kwargs))
+
+
+class InstrumentedIterator:
+    def __init__(self, iterator):
+        self._iterator = iterator
+
+    def __getattr__(self, name):
+        return getattr(self._iterator, name)
+
+    def __iter__(self):
+        for page in self.pages:
+            for entity in page:
+                yield entity
+
+    @property
+    def pages(self):
+        pages = self._iterator.pages
+        while True:
+            start = time.perf_counter()
+            try:
+                page = list(next(pages))
+            except StopIteration:
+                return
+            stats = current_stats()
+            if stats is not None:
+                stats.record("query", time.perf_counter() - start, len(page))
+            yield page
+
+
+class InstrumentedTransaction:
+    def __init__(self, transaction):
+        self._transaction = transaction
+
+    def __getattr__(self, name):
+        return getattr(self._transaction, name)
+
+    def __enter__(self):
+        self._transaction.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        start = time.perf_counter()
+        try:
+            return self._transaction.__exit__(*exc_info)
+        finally:
+            stats = current_stats()
+            if stats is not None:
+                stats.record("commit", time.perf_counter() - start)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+
+    def add(self, counts, total: float):
+        for n, count in enumerate(counts):
+            self.counts[n] += count
+        self.total += total
+
+    def lines(self, name: str, labels: str) -> list:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append('%s_bucket{%s,le="%s"} %d' % (
+                name, labels, bound, cumulative))
+        lines.append('%s_bucket{%s,le="+Inf"} %d' % (
+            name, labels, sum(self.counts)))
+        lines.append("%s_sum{%s} %s" % (name, labels, self.total))
+        lines.append("%s_count{%s} %d" % (name, labels, sum(self.counts)))
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.durations = {}
+        self.calls = {}
+        self.operations = {}
+        self.flushed = 0.0
+        self._timer = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    def observe(self, route: str, method: str, seconds: float, stats):
+        labels = 'route="%s",method="%s"' % (route, method)
+        with self._lock:
+            self.durations.setdefault(
+                labels, Histogram(DURATION_BUCKETS)).observe(seconds)
+            self.calls.setdefault(
+                labels, Histogram(CALL_BUCKETS)).observe(stats.calls())
+            for operation, totals in stats.operations.items():
+                counters = self.operations.setdefault(
+                    labels + ',operation="%s"' % operation, [0, 0, 0.0])
+                for n, value in enumerate(totals):
+                    counters[n] += value
+
+    def snapshot(self) -> dict:
+        # Everything /metrics reports for this process, as plain values
+        gauges = {}
+        for prefix, stats in (("arctic_entity_cache", entity_cache.stats()),
+                              ("arctic_token_cache", token_cache.stats()),
+                              ("arctic_admission", limiter.stats())):
+            for name, value in stats.items():
+                if isinstance(value, (int, float)):
+                    gauges["%s_%s" % (prefix, name)] = value
+        with self._lock:
+            return {"pid": os.getpid(),
+                    "durations": {labels: [h.counts, h.total]
+                                  for labels, h in self.durations.items()},
+                    "calls": {labels: [h.counts, h.total]
+                              for labels, h in self.calls.items()},
+                    "operations": {labels: list(counters) for labels,
+                                   counters in self.operations.items()},
+                    "gauges": gauges}
+
+    def flush(self, force=False):
+        # Writes this worker's file, replacing it in one step so a scrape on
+        # another worker never reads half of it
+        if METRICS_DIR is None:
+            return
+        with self._flush_lock:
+            now = time.monotonic()
+            due = self.flushed + METRICS_FLUSH - now
+            if not force and due > 0:
+                # Requests since the last write are written once the
+                # interval is over, even if no other request comes
+                if self._timer is None:
+                    self._timer = threading.Timer(due, self.flush, (True,))
+                    self._timer.daemon = True
+                    self._timer.start()
+                return
+            self.flushed = now
+            self._timer = None
+            path = os.path.join(METRICS_DIR, "%d.json" % os.getpid())
+            with open(path + ".tmp", "w") as file:
+                json.dump(self.snapshot(), file)
+            os.replace(path + ".tmp", path)
+
+    def render(self) -> str:
+        if METRICS_DIR is None:
+            snapshots = [self.snapshot()]
+        else:
+            self.flush(force=True)
+            snapshots = read_snapshots(METRICS_DIR)
+
+        # Histograms and counters are summed over every worker
+        durations = {}
+        calls = {}
+        operations = {}
+        for snapshot in snapshots:
+            for merged, buckets, key in (
+                    (durations, DURATION_BUCKETS, "durations"),
+                    (calls, CALL_BUCKETS, "calls")):
+                for labels, (counts, total) in snapshot[key].items():
+                    merged.setdefault(labels, Histogram(buckets)).add(
+                        counts, total)
+            for labels, totals in snapshot["operations"].items():
+                counters = operations.setdefault(labels, [0, 0, 0.0])
+                for n, value in enumerate(totals):
+                    counters[n] += value
+
+        lines = ["# TYPE arctic_request_duration_seconds histogram"]
+        for labels, histogram in sorted(durations.items()):
+            lines.extend(histogram.lines(
+                "arctic_request_duration_seconds", labels))
+        lines.append("# TYPE arctic_request_storage_calls histogram")
+        for labels, histogram in sorted(calls.items()):
+            lines.extend(histogram.lines(
+                "arctic_request_storage_calls", labels))
+        for n, name in enumerate(("calls", "entities", "seconds")):
+            lines.append("# TYPE arctic_storage_%s_total counter" % name)
+            for labels, counters in sorted(operations.items()):
+                lines.append("arctic_storage_%s_total{%s} %s" % (
+                    name, labels, counters[n]))
+
+        # Cache and admission figures describe one process each, so they
+        # are reported per worker
+        for snapshot in snapshots:
+            worker = ""
+            if METRICS_DIR is not None:
+                worker = '{worker="%d"}' % snapshot["pid"]
+            for name, value in sorted(snapshot["gauges"].items()):
+                lines.append("%s%s %s" % (name, worker, value))
+        return "\n".join(lines) + "\n"
+
+
+def read_snapshots(directory: str) -> list:
+    snapshots = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.json"))):
+        with open(path) as file:
+            snapshots.append(json.load(file))
+    return snapshots
+
+
+def mark_process_dead(pid: int):
+    # Called by gunicorn when a worker exits: its histograms and counters
+    # still count towards the totals, but its gauges no longer describe a
+    # running process
+    if METRICS_DIR is None:
+        return
+    path = os.path.join(METRICS_DIR, "%d.json" % pid)
+    try:
+        with open(path) as file:
+            snapshot = json.load(file)
+    except FileNotFoundError:
+        return
+    snapshot["gauges"] = {}
+    with open(path + ".tmp", "w") as file:
+        json.dump(snapshot, file)
+    os.replace(path + ".tmp", path)
+
+
+registry = Registry()
+
+
+def start_request():
+    g.storage_stats = RequestStats()
+    g.request_start = time.perf_counter()
+
+
+def finish_request(response):
+    stats = g.get("storage_stats")
+    if stats is None:
+        return response
+
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    seconds = time.perf_counter() - g.request_start
+    registry.observe(route, request.method, seconds, stats)
+    registry.flush()
+
+    timings = ['%s;dur=%.2f;desc="%d calls, %d entities"' % (
+        operation, totals[2] * 1000, totals[0], totals[1])
+        for operation, totals in sorted(stats.operations.items())]
+    timings.append("app;dur=%.2f" % (seconds * 1000))
+    response.headers["Server-Timing"] = ", ".join(timings)
+    return response
+
+
+def init_app(app):
+    app.before_request(start_request)
+    app.after_request(finish_request)
@@ -0,0 +1,116 @@
+import sys
+
+from collections import Counter
+from constants import ANIMALS, ICEBERGS, USERS
+from counters import counts, shard_entity, shard_keys
+from google.cloud import datastore
+from names import name_key
+
+
+# One-shot maintenance jobs, e.g. `python migrations.py names`
+def backfill_names(client, batch_size=500):
+    # Reserve the names of every existing Animal/Iceberg
+    for kind in (ANIMALS, ICEBERGS):
+        cursor = None
+        while True:
+            iterator = client.query(kind=kind).fetch(limit=batch_size,
+                                                     start_cursor=cursor)
+            page = list(next(iterator.pages))
+            reservations = []
+            for entity in page:
+                reservation = datastore.Entity(
+                    key=name_key(client, kind, entity["name"]),
+                    exclude_from_indexes=("owner",))
+                reservation.update({"owner": str(entity.id)})
+                reservations.append(reservation)
+            if reservations:
+                client.put_multi(reservations)
+
+            cursor = iterator.next_page_token
+            if not cursor:
+                break
+
+
+def rekey_users(client, batch_size=500):
+    # Move auto-ID Users to keys named after their Google "sub"
+    cursor = None
+    while True:
+        iterator = client.query(kind=USERS).fetch(limit=batch_size,
+                                                  start_cursor=cursor)
+        page = list(next(iterator.pages))
+        cursor = iterator.next_page_token
+
+        old_keys = []
+        users = {}
+        for user in page:
+            if user.key.id is None:
+                continue
+            old_keys.append(user.key)
+            rekeyed = datastore.Entity(key=client.key(USERS, user["id"]))
+            rekeyed.update(user)
+            users[user["id"]] = rekeyed
+
+        if old_keys:
+            # Write the new keys before removing the old ones so that no
+            # User is ever missing
+            client.put_multi(list(users.values()))
+            client.delete_multi(old_keys)
+
+        if not cursor:
+            break
+
+
+def lower_shapes(client, batch_size=500):
+    # Store every Iceberg's shape in lower case, as writes and ?shape=
+    # filters now do; run `stats` afterwards to recount the shapes
+    cursor = None
+    while True:
+        iterator = client.query(kind=ICEBERGS).fetch(limit=batch_size,
+                                                     start_cursor=cursor)
+        page = list(next(iterator.pages))
+        cursor = iterator.next_page_token
+
+        changed = []
+        for iceberg in page:
+            if iceberg["shape"] != iceberg["shape"].lower():
+                iceberg["shape"] = iceberg["shape"].lower()
+                changed.append(iceberg)
+        if changed:
+            client.put_multi(changed)
+
+        if not cursor:
+            break
+
+
+def rebuild_stats(client, batch_size=500):
+    # Recount every Animal/Iceberg and replace the sharded counters; writes
+    # made while the job runs may be missed, so run it while writes are paused
+    totals = Counter()
+    for kind in (ANIMALS, ICEBERGS):
+        cursor = None
+        while True:
+            iterator = client.query(kind=kind).fetch(limit=batch_size,
+                                                     start_cursor=cursor)
+            for entity in next(iterator.pages):
+                totals.update(counts(entity))
+
+            cursor = iterator.next_page_token
+            if not cursor:
+                break
+
+    # All of the totals go to the first shard and the others are emptied
+    keys = shard_keys(client)
+    with client.transaction():
+        client.delete_multi(keys[1:])
+        client.put(shard_entity(keys[0], {name: value
+                                          for name, value in totals.items()
+                                          if value}))
+
+
+JOBS = {"names": backfill_names, "users": rekey_users,
+        "shapes": lower_shapes, "stats": rebuild_stats}
+
+
+if __name__ == "__main__":
+    for job in sys.argv[1:] or JOBS:
+        JOBS[job](datastore.Client())
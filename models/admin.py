@@ -0,0 +1,165 @@
+import errors as ERR
+import json
+import os
+
+from constants import ANIMALS, BATCH_SIZE, ICEBERGS, USERS
+from flask import Blueprint, Response, request, stream_with_context
+from google.cloud import datastore
+from helpers import compress_response, status_fail, status_success,\
+    verify_jwt
+from names import name_key, reserve
+from serializers import dumps
+from storage import client, run_in_transaction
+
+bp = Blueprint("admin", __name__, url_prefix="/admin")
+
+# Google "sub" of the Users allowed to export and import the dataset
+ADMINS = set(filter(None, os.environ.get("ADMINS", "").split(",")))
+
+KINDS = (ICEBERGS, ANIMALS, USERS)
+EXPORT_PAGE_SIZE = 500
+
+
+def verify_admin():
+    # Returns the failure response for anyone who is not an admin
+    user = verify_jwt()
+    if user == "Error":
+        return status_fail(401, ERR.UNAUTHORIZED)
+    if user not in ADMINS:
+        return status_fail(403, ERR.NO_PERMISSION)
+    return None
+
+
+def export_lines(client, kinds):
+    # Walks each kind with cursors so only one page is held at a time
+    for kind in kinds:
+        cursor = None
+        while True:
+            iterator = client.query(kind=kind).fetch(limit=EXPORT_PAGE_SIZE,
+                                                     start_cursor=cursor)
+            for entity in next(iterator.pages):
+                yield json.dumps({"kind": kind,
+                                  "key": entity.key.id_or_name,
+                                  "properties": dict(entity)}) + "\n"
+            cursor = iterator.next_page_token
+            if not cursor:
+                break
+
+
+def import_entity(client, line: bytes) -> datastore.Entity:
+    item = json.loads(line)
+    if (not isinstance(item, dict)
+            or item.get("kind") not in KINDS
+            or not isinstance(item.get("key"), (int, str))
+            or not isinstance(item.get("properties"), dict)):
+        raise ValueError(line)
+
+    entity = datastore.Entity(key=client.key(item["kind"], item["key"]))
+    entity.update(item["properties"])
+    if item["kind"] != USERS and not isinstance(entity.get("name"), str):
+        raise ValueError(line)
+    return entity
+
+
+def import_batch(client, batch) -> list:
+    # batch holds (line number, entity) pairs. Writes every entity whose name
+    # is free or already its own together with its reservation, and returns
+    # the line numbers of those whose names belong to other entities
+    named = [entity for _, entity in batch if entity.kind != USERS]
+    claimed = {entity.key for entity in reserve(client, named)[0]}
+    client.put_multi([entity for _, entity in batch
+                      if entity.kind == USERS or entity.key in claimed])
+    return [line_number for line_number, entity in batch
+            if entity.kind != USERS and entity.key not in claimed]
+
+
+@bp.route("/export", methods=["GET"])
+def export_valid():
+    failure = verify_admin()
+    if failure is not None:
+        return failure
+
+    kinds = request.args.get("kinds", ",".join(KINDS)).split(",")
+    if any(kind not in KINDS for kind in kinds):
+        # Failure 400 Bad Request
+        return status_fail(400, ERR.INVALID_KINDS)
+
+    # Success 200 OK
+    lines = export_lines(client._get_current_object(), kinds)
+    return compress_response(Response(stream_with_context(lines),
+                                      mimetype="application/x-ndjson"))
+
+
+@bp.route("/import", methods=["POST"])
+def import_valid():
+    failure = verify_admin()
+    if failure is not None:
+        return failure
+
+    # Check media type
+    if "application/x-ndjson" not in request.content_type:
+        # Failure 415 Unsupported Media Type
+        return status_fail(415, ERR.WRONG_MEDIA_RECEIVED)
+
+    # Lines up to the checkpoint were committed by an earlier import
+    try:
+        checkpoint = int(request.args.get("checkpoint", 0))
+    except ValueError:
+        # Failure 400 Bad Request
+        return status_fail(400, ERR.INVALID_IMPORT)
+
+    # Entities are written in batches as the body is read, and every
+    # committed batch moves the checkpoint forward. Lines whose names belong
+    # to other entities, or to an earlier line of the same batch, are skipped
+    # and reported. Imports bypass the /stats counters, which are recounted
+    # with `python migrations.py stats`
+    pending = []
+    names = set()
+    conflicts = []
+    line_number = 0
+    committed = checkpoint
+    for line_number, line in enumerate(request.stream, 1):
+        if line_number <= checkpoint or not line.strip():
+            continue
+        try:
+            entity = import_entity(client, line)
+        except (KeyError, ValueError):
+            # Failure 400 Bad Request
+            response = status_fail(400, ERR.INVALID_IMPORT)
+            response.headers.set("Checkpoint", str(committed))
+            return response
+
+        if entity.kind != USERS:
+            key = name_key(client, entity.kind, entity["name"])
+            if key in names:
+                conflicts.append(line_number)
+                continue
+            names.add(key)
+        pending.append((line_number, entity))
+        if len(pending) >= (BATCH_SIZE - 1) // 2:
+            conflicts.extend(run_in_transaction(
+                lambda: import_batch(client, pending)))
+            pending = []
+            names = set()
+            committed = line_number
+
+    if pending:
+        conflicts.extend(run_in_transaction(
+            lambda: import_batch(client, pending)))
+    committed = max(committed, line_number)
+
+    # Success 200 OK
+    output = {"checkpoint": committed, "conflicts": sorted(conflicts)}
+    return status_success(200, output=dumps(output))
+
+
+@bp.route("/export", methods=["POST", "PUT", "PATCH", "DELETE"])
+def export_invalid():
+    # Failure 405 Method Not Allowed
+    return status_fail(405, ERR.METHOD_INVALID, header="GET")
+
+
+@bp.route("/import", methods=["GET", "PUT", "PATCH", "DELETE"])
+def import_invalid():
+    # Failure 405 Method Not Allowed
+    return status_fail(405, ERR.METHOD_INVALID, header="POST")
@@ -1,17 +1,23 @@
-import json
+import copy
 
 from flask import Blueprint, request
 from google.cloud import datastore
-from json2html import json2html
 
 import errors as ERR
 
-from constants import ICEBERGS, ANIMALS
-from helpers import animal_output, status_fail, status_success,\
+from constants import ANIMAL_FIELDS, ANIMAL_ORDERS, ANIMALS, BATCH_SIZE,\
+    ICEBERGS
+from counters import record
+from helpers import add_filters, add_order, changed_since, chunks,\
+    etag_matches, fetch_page, page_etag, parse_species, project_fields,\
+    requested_fields, resource_etag, status_fail, status_success,\
     valid_alphanum, valid_int
+from names import claim_name, claim_names, release_name
+from serializers import animal_output, dumps, list_output,\
+    negotiated_output
+from storage import client, run_in_transaction
 
 bp = Blueprint("animals", __name__, url_prefix="/animals")
-client = datastore.Client()
 
 
 @bp.route('', methods=["POST", "GET"])
@@ -45,54 +51,64 @@ def animals_valid():
             # Failure 400 Bad Request
             return status_fail(400, ERR.INVALID_HEIGHT)
 
-        # Ensure that the name of an Animal is unique across all Animals
-        query = client.query(kind=ANIMALS)
-        results = list(query.fetch())
-        for a in results:
-            if a["name"] == content["name"]:
-                # Failure 403 Forbidden
-                return status_fail(403, ERR.NAME_EXISTS)
-
         # Update Animal
         animal = datastore.Entity(key=client.key(ANIMALS))
         animal.update({"name": content["name"],
                        "species": content["species"],
                        "height": content["height"],
                        "home": None})
-        client.put(animal)
+
+        # Ensure that the name of an Animal is unique across all Animals
+        if not run_in_transaction(lambda: create_animals([animal])):
+            # Failure 403 Forbidden
+            return status_fail(403, ERR.NAME_EXISTS)
 
         # Success 201 Created
         output = animal_output(animal, client)
-        return status_success(201, output=json.dumps(output),
+        return status_success(201, output=dumps(output),
                               location=output["self"])
 
     # List all Animals
     elif request.method == "GET":
         query = client.query(kind=ANIMALS)
-        q_limit = int(request.args.get("limit", 5))
-        q_offset = int(request.args.get("offset", 0))
-        iterator = query.fetch(limit=q_limit, offset=q_offset)
-        results = list(next(iterator.pages))
-
-        if iterator.next_page_token:
-            next_offset = q_offset + q_limit
-            next_url = (request.base_url + "?limit=" + str(q_limit) +
-                                           "&offset=" + str(next_offset))
-        else:
-            next_url = None
 
-        for a in results:
-            a["id"] = a.id
-            a["self"] = request.url_root + "animals/" + str(a.id)
+        # Narrow down and sort the Animals in the query itself
+        if not add_filters(query, {"species": parse_species}, ("height",)):
+            # Failure 400 Bad Request
+            return status_fail(400, ERR.INVALID_FILTER)
+        if not add_order(query, ANIMAL_ORDERS):
+            # Failure 400 Bad Request
+            return status_fail(400, ERR.INVALID_ORDER)
+
+        # Only read the attributes that were asked for
+        try:
+            fields = requested_fields(ANIMAL_FIELDS)
+        except ValueError:
+            # Failure 400 Bad Request
+            return status_fail(400, ERR.INVALID_FIELDS)
+        fixed = project_fields(query, fields, ANIMAL_ORDERS)
+
+        # Get a page of results and the link to the next one
+        try:
+            results, next_url = fetch_page(query)
+        except ValueError:
+            # Failure 400 Bad Request
+            return status_fail(400, ERR.INVALID_PAGE)
 
-        output = {"animals": results}
+        # Not Modified when the client already has this page
+        etag = page_etag(results, next_url)
+        if etag_matches(request.if_none_match, etag):
+            # Success 304 Not Modified
+            return status_success(304, page=next_url, etag=etag)
+
+        output = {"animals": list_output(results, fields, fixed)}
         if next_url:
             output["next"] = next_url
-            return status_success(200, output=json.dumps(output),
-                                  page=next_url)
+            return status_success(200, output=dumps(output),
+                                  page=next_url, etag=etag)
 
         # Success 200 OK
-        return status_success(200, output=json.dumps(output))
+        return status_success(200, output=dumps(output), etag=etag)
 
     else:
         # Failure 405 Method Not Allowed
@@ -105,6 +121,83 @@ def animals_invalid():
     return status_fail(405, ERR.METHOD_INVALID, header="POST, GET")
 
 
+@bp.route("/batch", methods=["POST"])
+def animals_batch():
+    # Check media type
+    if "application/json" not in request.content_type:
+        # Failure 415 Unsupported Media Type
+        return status_fail(415, ERR.WRONG_MEDIA_RECEIVED)
+    if "application/json" not in request.accept_mimetypes:
+        # Failure 406 Not Acceptable
+        return status_fail(406, ERR.WRONG_MEDIA_REQUESTED)
+
+    content = request.get_json()
+    if not isinstance(content, list):
+        # Failure 400 Bad Request
+        return status_fail(400, ERR.INVALID_BATCH)
+
+    # Validate every Animal, including name uniqueness within the batch
+    results = [None] * len(content)
+    animals = []
+    names = set()
+    for index, item in enumerate(content):
+        error = animal_error(item)
+        if error is None and item["name"] in names:
+            results[index] = {"status": 403, "Error": ERR.NAME_EXISTS}
+        elif error is not None:
+            results[index] = {"status": 400, "Error": error}
+        else:
+            names.add(item["name"])
+            animal = datastore.Entity(key=client.key(ANIMALS))
+            animal.update({"name": item["name"],
+                           "species": item["species"],
+                           "height": item["height"],
+                           "home": None})
+            animals.append((index, animal))
+
+    # Each Animal and its name reservation are written in the same commit,
+    # which also moves one /stats shard
+    for batch in chunks(animals, (BATCH_SIZE - 1) // 2):
+        claimed = run_in_transaction(
+            lambda: create_animals([a for _, a in batch]))
+        claimed = {a.key for a in claimed}
+        for index, animal in batch:
+            if animal.key in claimed:
+                results[index] = {"status": 201,
+                                  "animal": animal_output(animal, client)}
+            else:
+                results[index] = {"status": 403, "Error": ERR.NAME_EXISTS}
+
+    # Success 200 OK
+    return status_success(200, output=dumps({"animals": results}))
+
+
+def create_animals(animals) -> list:
+    # Writes the Animals whose names were free along with their names and
+    # returns them
+    claimed = claim_names(client, animals)
+    if claimed:
+        record(client, [(a.key, a) for a in claimed])
+        client.put_multi(claimed)
+    return claimed
+
+
+def animal_error(content):
+    # Returns why an Animal cannot be created, if it cannot
+    if (not isinstance(content, dict)
+            or "name" not in content.keys()
+            or "species" not in content.keys()
+            or "height" not in content.keys()):
+        return ERR.MISSING_ATTRIBUTE
+    if not valid_alphanum(content["name"], 50):
+        return ERR.INVALID_NAME
+    if not valid_alphanum(content["species"], 50):
+        return ERR.INVALID_SPECIES
+    if not valid_int(content["height"], 25):
+        return ERR.INVALID_HEIGHT
+    return None
+
+
 @bp.route("/<animal_id>", methods=["GET", "PUT", "PATCH", "DELETE"])
 def animalid_valid(animal_id):
     animal_key = client.key(ANIMALS, int(animal_id))
@@ -117,18 +210,10 @@ def animalid_valid(animal_id):
 
     # Get an Animal
     if request.method == "GET":
-        if "application/json" in request.accept_mimetypes:
-            # Success 200 OK
-            output = animal_output(animal, client)
-            return status_success(200, output=json.dumps(output))
-        elif "text/html" in request.accept_mimetypes:
-            # Success 200 OK
-            output = animal_output(animal, client)
-            conversion = json2html.convert(json=json.dumps(output))
-            return status_success(200, output=conversion, mime="text/html")
-        else:
-            # Failure 406 Not Acceptable
-            return status_fail(406, ERR.WRONG_MEDIA_REQUESTED)
+        # Success 200 OK as JSON or HTML, or 304 Not Modified
+        return negotiated_output(lambda: animal_output(animal, client),
+                                 "views/animal.html", "animal",
+                                 resource_etag(animal, client))
 
     # Edit an Animal
     elif request.method == "PUT":
@@ -159,25 +244,19 @@ def animalid_valid(animal_id):
             # Failure 400 Bad Request
             return status_fail(400, ERR.INVALID_HEIGHT)
 
-        # Ensure that the name of an Animal is unique across all Animals
-        query = client.query(kind=ANIMALS)
-        results = list(query.fetch())
-        for a in results:
-            if a["name"] == content["name"]:
-                # Failure 403 Forbidden
-                return status_fail(403, ERR.NAME_EXISTS)
-
         # Update Animal
-        animal = datastore.Entity(key=client.key(ANIMALS))
-        animal.update({"name": content["name"],
-                       "species": content["species"],
-                       "height": content["height"]})
-        client.put(animal)
+        failure, animal = run_in_transaction(
+            lambda: edit_animal(animal_key, {"name": content["name"],
+                                             "species": content["species"],
+                                             "height": content["height"]}))
+        if failure is not None:
+            return failure
 
         # Success 303 See Other
         output = animal_output(animal, client)
-        return status_success(303, output=json.dumps(output),
-                              location=output["self"])
+        return status_success(303, output=dumps(output),
+                              location=output["self"],
+                              etag=resource_etag(animal, client))
 
     # Edit an Animal
     elif request.method == "PATCH":
@@ -191,51 +270,49 @@ def animalid_valid(animal_id):
 
         # Check if request contains any of the object attributes
         content = request.get_json()
+        changes = {}
         if "name" in content.keys():
             # Validate name
             if not valid_alphanum(content["name"], 50):
                 # Failure 400 Bad Request
                 return status_fail(400, ERR.INVALID_NAME)
-            # Ensure that the name of an Animals is unique across all Animals
-            query = client.query(kind=ANIMALS)
-            results = list(query.fetch())
-            for a in results:
-                if a["name"] == content["name"]:
-                    # Failure 403 Forbidden
-                    return status_fail(403, ERR.NAME_EXISTS)
-            animal.update({"name": content["name"]})
+            changes["name"] = content["name"]
         if "species" in content.keys():
             # Validate species
             if not valid_alphanum(content["species"], 50):
                 # Failure 400 Bad Request
                 return status_fail(400, ERR.INVALID_SPECIES)
-            animal.update({"species": content["species"]})
+            changes["species"] = content["species"]
         if "height" in content.keys():
             # Validate height
             if not valid_int(content["height"], 25):
                 # Failure 400 Bad Request
                 return status_fail(400, ERR.INVALID_HEIGHT)
-            animal.update({"height": content["height"]})
-        client.put(animal)
+            changes["height"] = content["height"]
+
+        # Update Animal
+        failure, animal = run_in_transaction(
+            lambda: edit_animal(animal_key, changes))
+        if failure is not None:
+            return failure
 
         # Success 303 See Other
         output = animal_output(animal, client)
-        return status_success(303, output=json.dumps(output),
-                              location=output["self"])
+        return status_success(303, output=dumps(output),
+                              location=output["self"],
+                              etag=resource_etag(animal, client))
 
     # Delete an Animal
     elif request.method == "DELETE":
-        iceberg_id = animal["home"]
-        iceberg_key = client.key(ICEBERGS, int(iceberg_id))
-        iceberg = client.get(key=iceberg_key)
-
-        if iceberg:
-            if str(animal_id) in iceberg["inhabitants"]:
-                iceberg["inhabitants"].remove(str(animal_id))
-                client.put(iceberg)
+        # The Animal, its name and its place on an Iceberg are removed in
+        # one commit
+        deleted = run_in_transaction(
+            lambda: delete_animal(animal_key, animal["home"]))
+        if not deleted:
+            # Failure 404 Not Found
+            return status_fail(404, ERR.NO_ANIMAL)
 
         # Success 204 No Content
-        client.delete(animal_key)
         return status_success(204)
 
     else:
@@ -243,6 +320,63 @@ def animalid_valid(animal_id):
         animalid_invalid()
 
 
+def edit_animal(animal_key, changes):
+    # Returns the failure response, or the Animal as read in this transaction
+    # with the validated changes applied, so a concurrent move of the Animal
+    # is never overwritten
+    animal = client.get(animal_key)
+    if animal is None:
+        # Failure 404 Not Found
+        return status_fail(404, ERR.NO_ANIMAL), None
+
+    # Only overwrite the version the client has seen
+    if changed_since(animal, client):
+        # Failure 412 Precondition Failed
+        return status_fail(412, ERR.PRECONDITION_FAILED), None
+
+    # Ensure that the name of an Animal is unique across all Animals
+    stored = copy.copy(animal)
+    animal.update(changes)
+    if (animal["name"] != stored["name"]
+            and not claim_name(client, animal, stored["name"])):
+        # Failure 403 Forbidden
+        return status_fail(403, ERR.NAME_EXISTS), None
+    record(client, [(animal_key, animal)], stored={animal_key: stored})
+    client.put(animal)
+    return None, animal
+
+
+def delete_animal(animal_key, home) -> bool:
+    # The Animal is read again with the Iceberg it lived on when the request
+    # started; the Iceberg is only looked up separately if it has moved since
+    keys = [animal_key]
+    if home is not None:
+        keys.append(client.key(ICEBERGS, int(home)))
+    found = {entity.key: entity for entity in client.get_multi(keys)}
+    animal = found.get(animal_key)
+    if animal is None:
+        return False
+
+    iceberg = None
+    if animal["home"] is not None:
+        iceberg_key = client.key(ICEBERGS, int(animal["home"]))
+        iceberg = found.get(iceberg_key) or client.get(iceberg_key)
+
+    # Remove the Animal from its Iceberg
+    inhabitants = []
+    if iceberg is not None:
+        inhabitants = iceberg["inhabitants"] or []
+    if str(animal.id) in inhabitants:
+        inhabitants.remove(str(animal.id))
+        iceberg["inhabitants"] = inhabitants or None
+        client.put(iceberg)
+
+    record(client, [(animal_key, None)], stored={animal_key: animal})
+    release_name(client, animal)
+    client.delete(animal_key)
+    return True
+
+
 @bp.route("/<animal_id>", methods=["POST"])
 def animalid_invalid(animal_id):
     # Failure 405 Method Not Allowed
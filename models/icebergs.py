@@ -1,17 +1,25 @@
-import json
+import copy
 
 from flask import Blueprint, request
 from google.cloud import datastore
-from json2html import json2html
 
 import errors as ERR
 
-from constants import ANIMALS, ICEBERGS
-from helpers import iceberg_output, status_fail, status_success,\
-    valid_alphanum, valid_int, valid_public, valid_shape, verify_jwt
+from concurrency import gather
+from constants import ANIMALS, BATCH_SIZE, ICEBERG_FIELDS, ICEBERG_ORDERS,\
+    ICEBERGS
+from counters import record
+from helpers import add_filters, add_order, changed_since, chunks,\
+    etag_matches, existing_homes, fetch_page, page_etag, parse_shape,\
+    project_fields, remember_relations, requested_fields, resource_etag,\
+    status_fail, status_success, valid_alphanum, valid_int, valid_public,\
+    valid_shape, verify_jwt
+from names import claim_name, claim_names, release_name
+from serializers import dumps, iceberg_output, list_output,\
+    negotiated_output
+from storage import client, run_in_transaction
 
 bp = Blueprint("icebergs", __name__, url_prefix="/icebergs")
-client = datastore.Client()
 
 
 @bp.route('', methods=["POST", "GET"])
@@ -54,27 +62,23 @@ def icebergs_valid():
             # Failure 400 Bad Request
             return status_fail(400, ERR.INVALID_PUBLIC)
 
-        # Ensure that the name of an Iceberg is unique across all Icebergs
-        query = client.query(kind=ICEBERGS)
-        results = list(query.fetch())
-        for i in results:
-            if i["name"] == content["name"]:
-                # Failure 403 Forbidden
-                return status_fail(403, ERR.NAME_EXISTS)
-
         # Update Iceberg
         iceberg = datastore.Entity(key=client.key(ICEBERGS))
         iceberg.update({"name": content["name"],
                         "area": content["area"],
-                        "shape": content["shape"],
+                        "shape": parse_shape(content["shape"]),
                         "inhabitants": None,
                         "public": content["public"],
                         "founder": user})
-        client.put(iceberg)
+
+        # Ensure that the name of an Iceberg is unique across all Icebergs
+        if not run_in_transaction(lambda: create_icebergs([iceberg])):
+            # Failure 403 Forbidden
+            return status_fail(403, ERR.NAME_EXISTS)
 
         # Success 201 Created
         output = iceberg_output(iceberg, client)
-        return status_success(201, output=json.dumps(output),
+        return status_success(201, output=dumps(output),
                               location=output["self"])
 
     # List all Icebergs
@@ -94,31 +98,43 @@ def icebergs_valid():
             # Return all Icebergs whose founder matches the user
             query = query.add_filter("founder", '=', user)
 
-        # Set limit, offset, and iterator
-        q_limit = int(request.args.get("limit", 5))
-        q_offset = int(request.args.get("offset", 0))
-        iterator = query.fetch(limit=q_limit, offset=q_offset)
-        results = list(next(iterator.pages))
+        # Narrow down and sort the Icebergs in the query itself
+        if not add_filters(query, {"shape": parse_shape}, ("area",)):
+            # Failure 400 Bad Request
+            return status_fail(400, ERR.INVALID_FILTER)
+        if not add_order(query, ICEBERG_ORDERS):
+            # Failure 400 Bad Request
+            return status_fail(400, ERR.INVALID_ORDER)
 
-        if iterator.next_page_token:
-            next_offset = q_offset + q_limit
-            next_url = (request.base_url + "?limit=" + str(q_limit) +
-                                           "&offset=" + str(next_offset))
-        else:
-            next_url = None
+        # Only read the attributes that were asked for
+        try:
+            fields = requested_fields(ICEBERG_FIELDS)
+        except ValueError:
+            # Failure 400 Bad Request
+            return status_fail(400, ERR.INVALID_FIELDS)
+        fixed = project_fields(query, fields, ICEBERG_ORDERS)
+
+        # Get a page of results and the link to the next one
+        try:
+            results, next_url = fetch_page(query)
+        except ValueError:
+            # Failure 400 Bad Request
+            return status_fail(400, ERR.INVALID_PAGE)
 
-        for i in results:
-            i["id"] = i.id
-            i["self"] = request.url_root + "icebergs/" + str(i.id)
+        # Not Modified when the client already has this page
+        etag = page_etag(results, next_url)
+        if etag_matches(request.if_none_match, etag):
+            # Success 304 Not Modified
+            return status_success(304, page=next_url, etag=etag)
 
-        output = {"icebergs": results}
+        output = {"icebergs": list_output(results, fields, fixed)}
         if next_url:
             output["next"] = next_url
-            return status_success(200, output=json.dumps(output),
-                                  page=next_url)
+            return status_success(200, output=dumps(output),
+                                  page=next_url, etag=etag)
 
         # Success 200 OK
-        return status_success(200, output=json.dumps(output))
+        return status_success(200, output=dumps(output), etag=etag)
 
     else:
         # Failure 405 Method Not Allowed
@@ -131,10 +147,98 @@ def icebergs_invalid():
     return status_fail(405, ERR.METHOD_INVALID, header="POST, GET")
 
 
+@bp.route("/batch", methods=["POST"])
+def icebergs_batch():
+    # Verify user
+    user = verify_jwt()
+    if user == "Error":
+        return status_fail(401, ERR.UNAUTHORIZED)
+
+    # Check media type
+    if "application/json" not in request.content_type:
+        # Failure 415 Unsupported Media Type
+        return status_fail(415, ERR.WRONG_MEDIA_RECEIVED)
+    if "application/json" not in request.accept_mimetypes:
+        # Failure 406 Not Acceptable
+        return status_fail(406, ERR.WRONG_MEDIA_REQUESTED)
+
+    content = request.get_json()
+    if not isinstance(content, list):
+        # Failure 400 Bad Request
+        return status_fail(400, ERR.INVALID_BATCH)
+
+    # Validate every Iceberg, including name uniqueness within the batch
+    results = [None] * len(content)
+    icebergs = []
+    names = set()
+    for index, item in enumerate(content):
+        error = iceberg_error(item)
+        if error is None and item["name"] in names:
+            results[index] = {"status": 403, "Error": ERR.NAME_EXISTS}
+        elif error is not None:
+            results[index] = {"status": 400, "Error": error}
+        else:
+            names.add(item["name"])
+            iceberg = datastore.Entity(key=client.key(ICEBERGS))
+            iceberg.update({"name": item["name"],
+                            "area": item["area"],
+                            "shape": parse_shape(item["shape"]),
+                            "inhabitants": None,
+                            "public": item["public"],
+                            "founder": user})
+            icebergs.append((index, iceberg))
+
+    # Each Iceberg and its name reservation are written in the same commit,
+    # which also moves one /stats shard
+    for batch in chunks(icebergs, (BATCH_SIZE - 1) // 2):
+        claimed = run_in_transaction(
+            lambda: create_icebergs([i for _, i in batch]))
+        claimed = {i.key for i in claimed}
+        for index, iceberg in batch:
+            if iceberg.key in claimed:
+                results[index] = {"status": 201,
+                                  "iceberg": iceberg_output(iceberg, client)}
+            else:
+                results[index] = {"status": 403, "Error": ERR.NAME_EXISTS}
+
+    # Success 200 OK
+    return status_success(200, output=dumps({"icebergs": results}))
+
+
+def create_icebergs(icebergs) -> list:
+    # Writes the Icebergs whose names were free along with their names and
+    # returns them
+    claimed = claim_names(client, icebergs)
+    if claimed:
+        record(client, [(i.key, i) for i in claimed])
+        client.put_multi(claimed)
+    return claimed
+
+
+def iceberg_error(content):
+    # Returns why an Iceberg cannot be created, if it cannot
+    if (not isinstance(content, dict)
+            or "name" not in content.keys()
+            or "area" not in content.keys()
+            or "shape" not in content.keys()
+            or "public" not in content.keys()):
+        return ERR.MISSING_ATTRIBUTE
+    if not valid_alphanum(content["name"], 50):
+        return ERR.INVALID_NAME
+    if not valid_int(content["area"], 8000):
+        return ERR.INVALID_AREA
+    if not valid_shape(content["shape"]):
+        return ERR.INVALID_SHAPE
+    if not valid_public(content["public"]):
+        return ERR.INVALID_PUBLIC
+    return None
+
+
 @bp.route("/<iceberg_id>", methods=["GET", "PUT", "PATCH", "DELETE"])
 def icebergid_valid(iceberg_id):
+    # The Iceberg is read while the token is verified
     iceberg_key = client.key(ICEBERGS, int(iceberg_id))
-    iceberg = client.get(key=iceberg_key)
+    iceberg, user = gather(lambda: client.get(key=iceberg_key), verify_jwt)
 
     # No Iceberg with this iceberg_id exists
     if iceberg is None:
@@ -142,7 +246,6 @@ def icebergid_valid(iceberg_id):
         return status_fail(404, ERR.NO_ICEBERG)
 
     # Verify user
-    user = verify_jwt()
     if user == "Error":
         return status_fail(401, ERR.UNAUTHORIZED)
 
@@ -151,18 +254,10 @@ def icebergid_valid(iceberg_id):
         if iceberg["founder"] != user and iceberg["public"] is False:
             return status_fail(403, ERR.NO_PERMISSION)
 
-        if "application/json" in request.accept_mimetypes:
-            # Success 200 OK
-            output = iceberg_output(iceberg, client)
-            return status_success(200, output=json.dumps(output))
-        elif "text/html" in request.accept_mimetypes:
-            # Success 200 OK
-            output = iceberg_output(iceberg, client)
-            conversion = json2html.convert(json=json.dumps(output))
-            return status_success(200, output=conversion, mime="text/html")
-        else:
-            # Failure 406 Not Acceptable
-            return status_fail(406, ERR.WRONG_MEDIA_REQUESTED)
+        # Success 200 OK as JSON or HTML, or 304 Not Modified
+        return negotiated_output(lambda: iceberg_output(iceberg, client),
+                                 "views/iceberg.html", "iceberg",
+                                 resource_etag(iceberg, client))
 
     # Edit an Iceberg
     elif request.method == "PUT":
@@ -200,25 +295,21 @@ def icebergid_valid(iceberg_id):
             # Failure 400 Bad Request
             return status_fail(400, ERR.INVALID_PUBLIC)
 
-        # Ensure that the name of an Iceberg is unique across all Icebergs
-        query = client.query(kind=ICEBERGS)
-        results = list(query.fetch())
-        for i in results:
-            if i["name"] == content["name"]:
-                # Failure 403 Forbidden
-                return status_fail(403, ERR.NAME_EXISTS)
-
         # Update Iceberg
-        iceberg.update({"name": content["name"],
-                        "area": content["area"],
-                        "shape": content["shape"],
-                        "public": content["public"]})
-        client.put(iceberg)
+        changes = {"name": content["name"],
+                   "area": content["area"],
+                   "shape": parse_shape(content["shape"]),
+                   "public": content["public"]}
+        failure, iceberg = run_in_transaction(
+            lambda: edit_iceberg(iceberg_key, changes))
+        if failure is not None:
+            return failure
 
         # Success 303 See Other
         output = iceberg_output(iceberg, client)
-        return status_success(303, output=json.dumps(output),
-                              location=output["self"])
+        return status_success(303, output=dumps(output),
+                              location=output["self"],
+                              etag=resource_etag(iceberg, client))
 
     # Edit an Iceberg
     elif request.method == "PATCH":
@@ -235,43 +326,43 @@ def icebergid_valid(iceberg_id):
 
         # Check if request contains any of the object attributes
         content = request.get_json()
+        changes = {}
         if "name" in content.keys():
             # Validate name
             if not valid_alphanum(content["name"], 50):
                 # Failure 400 Bad Request
                 return status_fail(400, ERR.INVALID_NAME)
-            # Ensure that the name of an Iceberg is unique across all Icebergs
-            query = client.query(kind=ICEBERGS)
-            results = list(query.fetch())
-            for i in results:
-                if i["name"] == content["name"]:
-                    # Failure 403 Forbidden
-                    return status_fail(403, ERR.NAME_EXISTS)
-            iceberg.update({"name": content["name"]})
+            changes["name"] = content["name"]
         if "area" in content.keys():
             # Validate area
             if not valid_int(content["area"], 8000):
                 # Failure 400 Bad Request
                 return status_fail(400, ERR.INVALID_AREA)
-            iceberg.update({"area": content["area"]})
+            changes["area"] = content["area"]
         if "shape" in content.keys():
             # Validate shape
             if not valid_shape(content["shape"]):
                 # Failure 400 Bad Request
                 return status_fail(400, ERR.INVALID_SHAPE)
-            iceberg.update({"shape": content["shape"]})
+            changes["shape"] = parse_shape(content["shape"])
         if "public" in content.keys():
             # Validate public
             if not valid_public(content["public"]):
                 # Failure 400 Bad Request
                 return status_fail(400, ERR.INVALID_PUBLIC)
-            iceberg.update({"public": content["public"]})
-        client.put(iceberg)
+            changes["public"] = content["public"]
+
+        # Update Iceberg
+        failure, iceberg = run_in_transaction(
+            lambda: edit_iceberg(iceberg_key, changes))
+        if failure is not None:
+            return failure
 
         # Success 303 See Other
         output = iceberg_output(iceberg, client)
-        return status_success(303, output=json.dumps(output),
-                              location=output["self"])
+        return status_success(303, output=dumps(output),
+                              location=output["self"],
+                              etag=resource_etag(iceberg, client))
 
     # Delete an Iceberg
     elif request.method == "DELETE":
@@ -279,16 +370,33 @@ def icebergid_valid(iceberg_id):
         if iceberg["founder"] != user:
             return status_fail(403, ERR.NO_PERMISSION)
 
-        # Remove Animals from Iceberg if applicable
+        # Find the Animals living on this Iceberg through its inhabitants,
+        # plus any whose home was not recorded there
+        animal_keys = {client.key(ANIMALS, int(animal_id))
+                       for animal_id in iceberg["inhabitants"] or []}
         query = client.query(kind=ANIMALS)
-        results = list(query.fetch())
-        for a in results:
-            if a["home"] == iceberg_id:
-                a.update({"home": None})
-                client.put(a)
+        query.add_filter("home", "=", iceberg_id)
+        query.keys_only()
+        animal_keys.update(a.key for a in query.fetch())
+
+        # Large Icebergs have their Animals moved off in batches first, each
+        # batch in one commit with the Iceberg's inhabitants, so a DELETE
+        # that fails part way leaves no Animal on a deleted Iceberg and can
+        # simply be sent again
+        animal_keys = list(animal_keys)
+        while len(animal_keys) + 3 > BATCH_SIZE:
+            batch = animal_keys[:BATCH_SIZE - 1]
+            animal_keys = animal_keys[BATCH_SIZE - 1:]
+            run_in_transaction(
+                lambda: detach_batch(iceberg_key, iceberg_id, batch))
+
+        # The Iceberg is removed along with the remaining Animals, its name
+        # and a /stats shard in one commit; its name is released as read in
+        # that commit, in case it was renamed since
+        run_in_transaction(
+            lambda: delete_iceberg(iceberg_key, iceberg_id, animal_keys))
 
         # Success 204 No Content
-        client.delete(iceberg_key)
         return status_success(204)
 
     else:
@@ -296,6 +404,62 @@ def icebergid_valid(iceberg_id):
         icebergid_invalid()
 
 
+def edit_iceberg(iceberg_key, changes):
+    # Returns the failure response, or the Iceberg as read in this
+    # transaction with the validated changes applied, so Animals moved on or
+    # off it concurrently stay among its inhabitants as they are
+    iceberg = client.get(iceberg_key)
+    if iceberg is None:
+        # Failure 404 Not Found
+        return status_fail(404, ERR.NO_ICEBERG), None
+
+    # Only overwrite the version the client has seen
+    if changed_since(iceberg, client):
+        # Failure 412 Precondition Failed
+        return status_fail(412, ERR.PRECONDITION_FAILED), None
+
+    # Ensure that the name of an Iceberg is unique across all Icebergs
+    stored = copy.copy(iceberg)
+    iceberg.update(changes)
+    if (iceberg["name"] != stored["name"]
+            and not claim_name(client, iceberg, stored["name"])):
+        # Failure 403 Forbidden
+        return status_fail(403, ERR.NAME_EXISTS), None
+    record(client, [(iceberg_key, iceberg)], stored={iceberg_key: stored})
+    client.put(iceberg)
+    return None, iceberg
+
+
+def delete_iceberg(iceberg_key, iceberg_id, animal_keys):
+    current = record(client, [(iceberg_key, None)]).get(iceberg_key)
+    detach_animals(client, iceberg_id, animal_keys)
+    if current is not None:
+        release_name(client, current)
+    client.delete(iceberg_key)
+
+
+def detach_animals(client, iceberg_id, animal_keys):
+    # Clear the home of every Animal that still lives on the Iceberg
+    animals = client.get_multi(list(animal_keys))
+    moved = [a for a in animals if a["home"] == iceberg_id]
+    for a in moved:
+        a.update({"home": None})
+    if moved:
+        client.put_multi(moved)
+
+
+def detach_batch(iceberg_key, iceberg_id, animal_keys):
+    # Moves some of the Animals off an Iceberg that is still there
+    iceberg = client.get(iceberg_key)
+    detach_animals(client, iceberg_id, animal_keys)
+    if iceberg is not None and iceberg["inhabitants"]:
+        detached = {str(key.id) for key in animal_keys}
+        iceberg["inhabitants"] = [animal_id
+                                  for animal_id in iceberg["inhabitants"]
+                                  if animal_id not in detached] or None
+        client.put(iceberg)
+
+
 @bp.route("/<iceberg_id>", methods=["POST"])
 def icebergid_invalid(iceberg_id):
     # Failure 405 Method Not Allowed
@@ -303,74 +467,173 @@ def icebergid_invalid(iceberg_id):
                        header="GET, PUT, PATCH, DELETE")
 
 
+@bp.route("/<iceberg_id>/animals", methods=["PUT", "DELETE"])
+def icebergid_animals_valid(iceberg_id):
+    # Verify user
+    user = verify_jwt()
+    if user == "Error":
+        return status_fail(401, ERR.UNAUTHORIZED)
+
+    # Check media type
+    if "application/json" not in request.content_type:
+        # Failure 415 Unsupported Media Type
+        return status_fail(415, ERR.WRONG_MEDIA_RECEIVED)
+    if "application/json" not in request.accept_mimetypes:
+        # Failure 406 Not Acceptable
+        return status_fail(406, ERR.WRONG_MEDIA_REQUESTED)
+
+    # The Iceberg and every changed Animal must fit in one commit
+    content = request.get_json()
+    if (not isinstance(content, dict)
+            or not isinstance(content.get("animals"), list)
+            or len(content["animals"]) >= BATCH_SIZE):
+        # Failure 400 Bad Request
+        return status_fail(400, ERR.INVALID_ANIMAL_IDS)
+
+    iceberg_key = client.key(ICEBERGS, int(iceberg_id))
+    animal_ids = list(dict.fromkeys(str(a) for a in content["animals"]))
+    animal_keys = {animal_id: client.key(ANIMALS, int(animal_id))
+                   for animal_id in animal_ids if animal_id.isdigit()}
+
+    # Every Animal is moved, or reported, in one commit with the Iceberg
+    failure, iceberg, results, changed = run_in_transaction(
+        lambda: move_animals(iceberg_key, animal_ids, animal_keys))
+    if failure is not None:
+        return failure
+
+    # Success 200 OK
+    remember_relations(*changed)
+    output = {"iceberg": iceberg_output(iceberg, client), "animals": results}
+    return status_success(200, output=dumps(output))
+
+
+def move_animals(iceberg_key, animal_ids, animal_keys):
+    # Returns the failure response, or the changed Iceberg with a result for
+    # each Animal and the Animals that moved
+    results = []
+    changed = []
+    found = client.get_multi([iceberg_key] + list(animal_keys.values()))
+    found = {entity.key: entity for entity in found}
+    iceberg = found.get(iceberg_key)
+
+    # No Iceberg with this iceberg_id exists
+    if iceberg is None:
+        # Failure 404 Not Found
+        return status_fail(404, ERR.NO_ICEBERG), None, None, None
+
+    inhabitants = iceberg["inhabitants"] or []
+    homes = existing_homes([found[key] for key in animal_keys.values()
+                            if key in found], client, iceberg)
+    for animal_id in animal_ids:
+        animal = found.get(animal_keys.get(animal_id))
+        if animal is None:
+            results.append({"id": animal_id, "status": 404,
+                            "Error": ERR.NO_ANIMAL})
+
+        # Put an Animal on an Iceberg
+        elif request.method == "PUT":
+            if animal["home"] in homes:
+                results.append({"id": animal_id, "status": 400,
+                                "Error": ERR.ANIMAL_ASSIGNED})
+                continue
+            animal.update({"home": str(iceberg.id)})
+            inhabitants.append(animal_id)
+            changed.append(animal)
+            results.append({"id": animal_id, "status": 200})
+
+        # Remove an Animal from an Iceberg
+        else:
+            if animal_id not in inhabitants:
+                results.append({"id": animal_id, "status": 404,
+                                "Error": ERR.NO_ANIMAL_HERE})
+                continue
+            animal.update({"home": None})
+            inhabitants.remove(animal_id)
+            changed.append(animal)
+            results.append({"id": animal_id, "status": 200})
+
+    if changed:
+        iceberg["inhabitants"] = inhabitants or None
+        client.put_multi([iceberg] + changed)
+    return None, iceberg, results, changed
+
+
+@bp.route("/<iceberg_id>/animals", methods=["POST", "GET", "PATCH"])
+def icebergid_animals_invalid(iceberg_id):
+    # Failure 405 Method Not Allowed
+    return status_fail(405, ERR.METHOD_INVALID, header="PUT, DELETE")
+
+
 @bp.route("/<iceberg_id>/animals/<animal_id>", methods=["PUT", "DELETE"])
 def icebergid_animals_animalid_valid(iceberg_id, animal_id):
     iceberg_key = client.key(ICEBERGS, int(iceberg_id))
     animal_key = client.key(ANIMALS, int(animal_id))
-    iceberg = client.get(key=iceberg_key)
-    animal = client.get(key=animal_key)
+    user = verify_jwt()
+
+    # The Iceberg and the Animal are read and written in one commit, so home
+    # and inhabitants always change together
+    failure, iceberg, animal = run_in_transaction(
+        lambda: move_animal(iceberg_key, animal_key, user))
+    if failure is not None:
+        return failure
+
+    # Put an Animal on an Iceberg
+    if request.method == "PUT":
+        # Success 303 See Other
+        remember_relations(animal)
+        output = iceberg_output(iceberg, client)
+        return status_success(303, output=dumps(output),
+                              location=output["self"])
+
+    # Remove an Animal from an Iceberg
+    # Success 204 No Content
+    return status_success(204)
+
+
+def move_animal(iceberg_key, animal_key, user):
+    # Returns the failure response, or the changed Iceberg and Animal
+    found = client.get_multi([iceberg_key, animal_key])
+    found = {entity.key: entity for entity in found}
+    iceberg = found.get(iceberg_key)
+    animal = found.get(animal_key)
 
     # Check if Iceberg and Animal exist
     if iceberg is None:
         if animal is None:
-            return status_fail(404, ERR.NEITHER_EXISTS)
-        return status_fail(404, ERR.NO_ICEBERG)
+            return status_fail(404, ERR.NEITHER_EXISTS), None, None
+        return status_fail(404, ERR.NO_ICEBERG), None, None
     if animal is None:
-        return status_fail(404, ERR.NO_ANIMAL)
+        return status_fail(404, ERR.NO_ANIMAL), None, None
 
     # Verify user
-    user = verify_jwt()
     if user == "Error":
-        return status_fail(401, ERR.UNAUTHORIZED)
+        return status_fail(401, ERR.UNAUTHORIZED), None, None
+
+    animal_id = str(animal.id)
+    inhabitants = iceberg["inhabitants"] or []
 
     # Put an Animal on an Iceberg
     if request.method == "PUT":
         # Check media type
         if "application/json" not in request.content_type:
             # Failure 415 Unsupported Media Type
-            return status_fail(415, ERR.WRONG_MEDIA_RECEIVED)
+            return status_fail(415, ERR.WRONG_MEDIA_RECEIVED), None, None
 
-        if animal["home"] is None:
-            animal.update({"home": str(iceberg.id)})
-        else:
-            return status_fail(400, ERR.ANIMAL_ASSIGNED)
-
-        # Add Animal to Iceberg
-        if iceberg["inhabitants"] is None:
-            iceberg["inhabitants"] = [str(animal.id)]
-        else:
-            iceberg["inhabitants"].append(str(animal.id))
-
-        client.put(iceberg)
-        client.put(animal)
-
-        # Success 303 See Other
-        output = iceberg_output(iceberg, client)
-        return status_success(303, output=json.dumps(output),
-                              location=output["self"])
+        if animal["home"] in existing_homes([animal], client, iceberg):
+            return status_fail(400, ERR.ANIMAL_ASSIGNED), None, None
+        animal.update({"home": str(iceberg.id)})
+        inhabitants.append(animal_id)
 
     # Remove an Animal from an Iceberg
-    elif request.method == "DELETE":
-        if iceberg["inhabitants"] is None:
-            return status_fail(404, ERR.NO_ANIMAL_HERE)
-
-        if "inhabitants" in iceberg.keys():
-            if str(animal_id) in iceberg["inhabitants"]:
-                iceberg["inhabitants"].remove(str(animal_id))
-                if len(iceberg["inhabitants"]) == 0:
-                    iceberg["inhabitants"] = None
-                animal["home"] = None
-                client.put(iceberg)
-                client.put(animal)
-            else:
-                return status_fail(404, ERR.NO_ANIMAL_HERE)
-
-        # Success 204 No Content
-        return status_success(204)
-
     else:
-        # Failure 405 Method Not Allowed
-        icebergid_animals_animalid_invalid()
+        if animal_id not in inhabitants:
+            return status_fail(404, ERR.NO_ANIMAL_HERE), None, None
+        animal.update({"home": None})
+        inhabitants.remove(animal_id)
+
+    iceberg["inhabitants"] = inhabitants or None
+    client.put_multi([iceberg, animal])
+    return None, iceberg, animal
 
 
 @bp.route("/<iceberg_id>/animals/<animal_id>",
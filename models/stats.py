@@ -0,0 +1,53 @@
+import errors as ERR
+import json
+
+from counters import read_totals
+from flask import Blueprint, request
+from helpers import content_hash, etag_matches, status_fail,\
+    status_success
+from serializers import dumps
+from storage import client
+
+bp = Blueprint("stats", __name__, url_prefix="/stats")
+
+
+def stats_output(totals) -> dict:
+    # Counters are stored flat, e.g. "shape:dome" and "species:penguin"
+    shapes = {}
+    species = {}
+    for name, value in sorted(totals.items()):
+        if name.startswith("shape:") and value:
+            shapes[name[len("shape:"):]] = value
+        elif name.startswith("species:") and value:
+            species[name[len("species:"):]] = value
+    return {"icebergs": {"count": totals["icebergs"],
+                         "area": totals["area"],
+                         "shapes": shapes},
+            "animals": {"count": totals["animals"],
+                        "species": species}}
+
+
+@bp.route('', methods=["GET"])
+def stats_valid():
+    if "application/json" not in request.accept_mimetypes:
+        # Failure 406 Not Acceptable
+        return status_fail(406, ERR.WRONG_MEDIA_REQUESTED)
+
+    # One lookup of every shard, however many Animals and Icebergs exist
+    totals = read_totals(client)
+
+    # Not Modified when the client already has these totals
+    etag = content_hash([], json.dumps(totals, sort_keys=True))
+    if etag_matches(request.if_none_match, etag):
+        # Success 304 Not Modified
+        return status_success(304, etag=etag)
+
+    # Success 200 OK
+    output = stats_output(totals)
+    return status_success(200, output=dumps(output), etag=etag)
+
+
+@bp.route('', methods=["POST", "PUT", "PATCH", "DELETE"])
+def stats_invalid():
+    # Failure 405 Method Not Allowed
+    return status_fail(405, ERR.METHOD_INVALID, header="GET")
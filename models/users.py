@@ -1,13 +1,30 @@
 import errors as ERR
-import json
 
-from constants import ICEBERGS, USERS
+from constants import ICEBERG_FIELDS, ICEBERG_ORDERS, ICEBERGS, USERS
 from flask import Blueprint, request
 from google.cloud import datastore
-from helpers import status_fail, status_success, verify_jwt
+from helpers import etag_matches, fetch_page, page_etag, project_fields,\
+    requested_fields, status_fail, status_success, verify_jwt
+from serializers import dumps, list_output
+from storage import client, run_in_transaction
 
 bp = Blueprint("users", __name__, url_prefix="/users")
-client = datastore.Client()
+
+
+def get_or_create_user(user_id: str):
+    # Users are keyed by their Google "sub" so logins need a single lookup;
+    # two first logins at once both find no User, and the second commit is
+    # retried and finds the first one's
+    user_key = client.key(USERS, user_id)
+
+    def get_or_create():
+        user = client.get(user_key)
+        if user is None:
+            user = datastore.Entity(key=user_key)
+            user.update({"id": user_id})
+            client.put(user)
+        return user
+    return run_in_transaction(get_or_create)
 
 
 @bp.route('', methods=["GET"])
@@ -19,7 +36,7 @@ def users_valid():
 
         # Success 200 OK
         output = {"users": results}
-        return status_success(200, output=json.dumps(output))
+        return status_success(200, output=dumps(output))
 
     else:
         # Failure 405 Method Not Allowed
@@ -48,31 +65,37 @@ def userid_icebergs_valid(user_id):
             # Return public Icebergs only
             query.add_filter("public", "=", True)
 
-        # Set limit, offset, and iterator
-        q_limit = int(request.args.get("limit", 5))
-        q_offset = int(request.args.get("offset", 0))
-        iterator = query.fetch(limit=q_limit, offset=q_offset)
-        results = list(next(iterator.pages))
-
-        if iterator.next_page_token:
-            next_offset = q_offset + q_limit
-            next_url = (request.base_url + "?limit=" + str(q_limit) +
-                                           "&offset=" + str(next_offset))
-        else:
-            next_url = None
-
-        for i in results:
-            i["id"] = i.id
-            i["self"] = request.url_root + "icebergs/" + str(i.id)
-
-        output = {"icebergs": results}
+        # Only read the attributes that were asked for; no index covers
+        # projections filtered by both founder and public
+        try:
+            fields = requested_fields(ICEBERG_FIELDS)
+        except ValueError:
+            # Failure 400 Bad Request
+            return status_fail(400, ERR.INVALID_FIELDS)
+        indexed = ICEBERG_ORDERS if user != "Error" else ()
+        fixed = project_fields(query, fields, indexed)
+
+        # Get a page of results and the link to the next one
+        try:
+            results, next_url = fetch_page(query)
+        except ValueError:
+            # Failure 400 Bad Request
+            return status_fail(400, ERR.INVALID_PAGE)
+
+        # Not Modified when the client already has this page
+        etag = page_etag(results, next_url)
+        if etag_matches(request.if_none_match, etag):
+            # Success 304 Not Modified
+            return status_success(304, page=next_url, etag=etag)
+
+        output = {"icebergs": list_output(results, fields, fixed)}
         if next_url:
             output["next"] = next_url
-            return status_success(200, output=json.dumps(output),
-                                  page=next_url)
+            return status_success(200, output=dumps(output),
+                                  page=next_url, etag=etag)
 
         # Success 200 OK
-        return status_success(200, output=json.dumps(output))
+        return status_success(200, output=dumps(output), etag=etag)
 
     else:
         # Failure 405 Method Not Allowed
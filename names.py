@@ -0,0 +1,65 @@
+from constants import NAMES
+from google.cloud import datastore
+
+
+# Every Animal/Iceberg name is reserved by an entity keyed on "<kind>:<name>",
+# so checking uniqueness is a keyed lookup instead of a scan over the kind.
+# Claims and releases must run inside a transaction together with the write
+# of the named entity so that concurrent writers cannot both succeed.
+def name_key(client, kind: str, name: str):
+    return client.key(NAMES, kind + ":" + name)
+
+
+def claim_name(client, entity, old_name=None) -> bool:
+    # A rename gives up the old name, but only while this entity still owns
+    # it; both reservations are read with the same lookup
+    old_key = None
+    if old_name is not None and old_name != entity["name"]:
+        old_key = name_key(client, entity.kind, old_name)
+    claimed, owners = reserve(client, [entity], [old_key] if old_key else [])
+    if not claimed:
+        return False
+    if old_key is not None and owners.get(old_key) == str(entity.key.id):
+        client.delete(old_key)
+    return True
+
+
+def claim_names(client, entities) -> list:
+    # Claims the names of entities of one kind with a single lookup and
+    # returns the entities whose names were free
+    return reserve(client, entities)[0]
+
+
+def reserve(client, entities, also=()) -> tuple:
+    # Returns the entities whose names were free and the owners of every
+    # reservation looked up, including those of the keys in also; entities
+    # need an ID before they can own a name
+    partial = [entity for entity in entities if entity.key.is_partial]
+    if partial:
+        keys = client.allocate_ids(partial[0].key, len(partial))
+        for entity, key in zip(partial, keys):
+            entity.key = key
+
+    keys = [name_key(client, entity.kind, entity["name"])
+            for entity in entities]
+    owners = {reservation.key: reservation["owner"]
+              for reservation in client.get_multi(keys + list(also))}
+
+    claimed = []
+    reservations = []
+    for entity, key in zip(entities, keys):
+        owner = str(entity.key.id)
+        if owners.get(key, owner) != owner:
+            continue
+        reservation = datastore.Entity(key=key,
+                                       exclude_from_indexes=("owner",))
+        reservation.update({"owner": owner})
+        reservations.append(reservation)
+        claimed.append(entity)
+    if reservations:
+        client.put_multi(reservations)
+    return claimed, owners
+
+
+def release_name(client, entity):
+    client.delete(name_key(client, entity.kind, entity["name"]))
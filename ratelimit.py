@@ -0,0 +1,209 @@
+import math
+import os
+import threading
+import time
+
+import cache
+import errors as ERR
+
+from collections import OrderedDict
+from flask import g, request
+from helpers import status_fail, verify_jwt
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+# "memory" for a single instance, "redis" to share limits between instances,
+# or "none" to turn rate limiting off
+RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_SIZE = int(os.environ.get("RATE_LIMIT_SIZE", 100000))
+
+# Requests per second and burst allowed to each user, or to each address for
+# anonymous requests, by group of routes, e.g. RATE_LIMIT_READ=20/40
+LIMITS = {"read": os.environ.get("RATE_LIMIT_READ", "20/40"),
+          "write": os.environ.get("RATE_LIMIT_WRITE", "5/10"),
+          "admin": os.environ.get("RATE_LIMIT_ADMIN", "1/5")}
+
+# Requests one process serves at once; the rest are turned away before any
+# work is done for them. 0 turns the limit off. gunicorn.conf.py gives each
+# process THREADS threads, and requests beyond those wait in gunicorn
+# without ever reaching the app, so by default a quarter of the threads are
+# kept back to turn requests away quickly once the others are busy
+THREADS = int(os.environ.get("THREADS", 8))
+MAX_IN_FLIGHT = int(os.environ.get("MAX_IN_FLIGHT",
+                                   max(THREADS - THREADS // 4, 1)))
+
+# Blueprints whose routes are never limited, such as /metrics
+EXEMPT = ("main",)
+
+# Proxies in front of the app that append to X-Forwarded-For, such as App
+# Engine's front end; anonymous requests are limited by the address the
+# outermost of them saw. 0 trusts no header and uses the peer address
+PROXY_HOPS = int(os.environ.get("PROXY_HOPS", 0))
+
+
+class MemoryBuckets:
+    # In-process token buckets, enough for a single instance; the buckets
+    # idle the longest are dropped once more than maxsize are held
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, name: str, rate: float, burst: int) -> float:
+        # Takes a token and returns 0, or returns the seconds until one is
+        # available
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.pop(name, (burst, now))
+            tokens = min(burst, tokens + (now - last) * rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            self._buckets[name] = (tokens, now)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+class RedisBuckets:
+    # Token buckets shared between instances. The refill and take run as one
+    # script on Redis' clock, so instances need neither locks nor synced
+    # clocks; any client with register_script can stand in for Redis
+    SCRIPT = """
+        local rate = tonumber(ARGV[1])
+        local burst = tonumber(ARGV[2])
+        local clock = redis.call("TIME")
+        local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+        local bucket = redis.call("HMGET", KEYS[1], "tokens", "last")
+        local tokens = tonumber(bucket[1]) or burst
+        local last = tonumber(bucket[2]) or now
+        tokens = math.min(burst, tokens + (now - last) * rate)
+        local wait = 0
+        if tokens >= 1 then
+            tokens = tokens - 1
+        else
+            wait = (1 - tokens) / rate
+        end
+        redis.call("HMSET", KEYS[1], "tokens", tokens, "last", now)
+        redis.call("EXPIRE", KEYS[1], math.ceil(burst / rate) + 1)
+        return tostring(wait)
+    """
+
+    def __init__(self, url: str = None, redis_client=None):
+        if redis_client is None:
+            redis_client = cache.redis_client(url)
+        self._take = redis_client.register_script(self.SCRIPT)
+
+    def take(self, name: str, rate: float, burst: int) -> float:
+        return float(self._take(keys=["ratelimit:" + name],
+                                args=[rate, burst]))
+
+
+class RateLimiter:
+    def __init__(self, buckets, limits, max_in_flight: int):
+        self.buckets = buckets
+        self.limits = {}
+        for group, limit in limits.items():
+            rate, burst = limit.split("/")
+            self.limits[group] = (float(rate), int(burst))
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.limited = 0
+        self.shed = 0
+        self._lock = threading.Lock()
+
+    def admit(self) -> bool:
+        with self._lock:
+            if self.max_in_flight and self.in_flight >= self.max_in_flight:
+                self.shed += 1
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def wait(self, group: str, caller: str) -> float:
+        if self.buckets is None:
+            return 0.0
+        rate, burst = self.limits[group]
+        wait = self.buckets.take(group + ":" + caller, rate, burst)
+        if wait:
+            with self._lock:
+                self.limited += 1
+        return wait
+
+    def stats(self) -> dict:
+        return {"in_flight": self.in_flight,
+                "limited": self.limited,
+                "shed": self.shed}
+
+
+def create_limiter() -> RateLimiter:
+    if RATE_LIMIT_BACKEND == "redis":
+        buckets = RedisBuckets(os.environ.get("REDIS_URL",
+                                              "redis://localhost:6379/0"))
+    elif RATE_LIMIT_BACKEND == "none":
+        buckets = None
+    else:
+        buckets = MemoryBuckets(RATE_LIMIT_SIZE)
+    return RateLimiter(buckets, LIMITS, MAX_IN_FLIGHT)
+
+
+limiter = create_limiter()
+
+
+def route_group() -> str:
+    if request.blueprint == "admin":
+        return "admin"
+    if request.method in ("GET", "HEAD", "OPTIONS"):
+        return "read"
+    return "write"
+
+
+def caller() -> str:
+    # Users are limited by their Google "sub", anonymous requests by address;
+    # see PROXY_HOPS
+    user = verify_jwt()
+    if user != "Error":
+        return "user:" + user
+    return "addr:" + str(request.remote_addr)
+
+
+def admit_request():
+    if request.blueprint in EXEMPT:
+        return None
+
+    # Shed load before spending anything on the request
+    if not limiter.admit():
+        # Failure 503 Service Unavailable
+        response = status_fail(503, ERR.OVERLOADED)
+        response.headers["Retry-After"] = "1"
+        return response
+    g.admitted = True
+
+    # Without limits the token is left for the handler to check, where it
+    # can run alongside the handler's storage calls
+    if limiter.buckets is None:
+        return None
+    wait = limiter.wait(route_group(), caller())
+    if wait:
+        # Failure 429 Too Many Requests
+        response = status_fail(429, ERR.RATE_LIMITED)
+        response.headers["Retry-After"] = str(math.ceil(wait))
+        return response
+    return None
+
+
+def release_request(exc):
+    if g.pop("admitted", False):
+        limiter.release()
+
+
+def init_app(app):
+    if PROXY_HOPS > 0:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_HOPS, x_proto=0)
+    app.before_request(admit_request)
+    app.teardown_request(release_request)
@@ -0,0 +1,127 @@
+import errors as ERR
+import json
+import os
+
+from cache import MemoryStore
+from constants import ANIMALS, ICEBERGS
+from flask import render_template, request
+from helpers import etag_matches, load_relations, status_fail,\
+    status_success, url_root
+
+# orjson is optional; the standard library encoder is used without it
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Rendered HTML views, keyed by the URL root and the ETag of the
+# representation
+HTML_CACHE_SIZE = int(os.environ.get("HTML_CACHE_SIZE", 1000))
+HTML_CACHE_TTL = 3600
+HTML_TEMPLATES = ("views/animal.html", "views/iceberg.html")
+
+html_cache = MemoryStore(HTML_CACHE_SIZE)
+
+
+def dumps(output):
+    if orjson is not None:
+        return orjson.dumps(output)
+    return json.dumps(output, separators=(",", ":"))
+
+
+def self_url(kind: str, entity_id) -> str:
+    return url_root() + kind + "/" + str(entity_id)
+
+
+def list_output(entities, fields=None, fixed=None) -> list:
+    # Entities are copied into plain dicts rather than modified in place
+    if fields is None:
+        return [dict(entity, id=entity.id,
+                     self=self_url(entity.kind, entity.id))
+                for entity in entities]
+
+    # Only the selected fields, with values fixed by the query's filters
+    output = []
+    for entity in entities:
+        values = dict(fixed or {}, **entity)
+        values.update(id=entity.id, self=self_url(entity.kind, entity.id))
+        output.append({field: values.get(field) for field in fields})
+    return output
+
+
+def negotiated_output(build, template: str, name: str, etag: str):
+    # JSON and HTML views of a resource are both built from build(); HTML is
+    # rendered from a template once per version and then served from cache
+    if "application/json" in request.accept_mimetypes:
+        mime = "application/json"
+    elif "text/html" in request.accept_mimetypes:
+        mime = "text/html"
+        etag += "-html"
+    else:
+        # Failure 406 Not Acceptable
+        return status_fail(406, ERR.WRONG_MEDIA_REQUESTED)
+
+    # Only serve the version the client expects
+    if request.if_match and not etag_matches(request.if_match, etag):
+        # Failure 412 Precondition Failed
+        return status_fail(412, ERR.PRECONDITION_FAILED)
+
+    # Not Modified when the client already has this version
+    if etag_matches(request.if_none_match, etag):
+        # Success 304 Not Modified
+        return status_success(304, mime=mime, etag=etag)
+
+    if mime == "application/json":
+        # Success 200 OK
+        return status_success(200, output=dumps(build()), etag=etag)
+
+    # Pages embed self URLs, and so does the ETag of every version
+    html = html_cache.get(etag)
+    if html is None:
+        html = render_template(template, **{name: build()})
+        html_cache.set(etag, html, HTML_CACHE_TTL)
+
+    # Success 200 OK
+    return status_success(200, output=html, mime=mime, etag=etag)
+
+
+def animal_output(animal, client):
+    relations = load_relations([animal], client)
+    home_info = None
+    if animal["home"] is not None:
+        home_id = str(animal["home"])
+        animal_home = relations[client.key(ICEBERGS, int(home_id))]
+        if animal_home is not None:
+            home_info = {"id": home_id,
+                         "name": animal_home["name"],
+                         "self": self_url(ICEBERGS, home_id)}
+    return {"id": str(animal.id),
+            "name": animal["name"],
+            "species": animal["species"],
+            "height": animal["height"],
+            "home": home_info,
+            "self": self_url(ANIMALS, animal.id)}
+
+
+def iceberg_output(iceberg, client):
+    relations = load_relations([iceberg], client)
+    inhabitants = []
+    if iceberg["inhabitants"] is not None:
+        for animal_key in iceberg["inhabitants"]:
+            this_animal = relations[client.key(ANIMALS, int(animal_key))]
+            if this_animal is None:
+                continue
+            animal_id = str(this_animal.id)
+            result = {"id": animal_id,
+                      "name": this_animal["name"],
+                      "self": self_url(ANIMALS, animal_id)}
+            inhabitants.append(result)
+    return {"id": str(iceberg.id),
+            "name": iceberg["name"],
+            "area": iceberg["area"],
+            "shape": iceberg["shape"],
+            "inhabitants": inhabitants,
+            "public": iceberg["public"],
+            "founder": iceberg["founder"],
+            "self": self_url(ICEBERGS, iceberg.id)}
@@ -0,0 +1,89 @@
+import google.auth
+import os
+import random
+import requests
+import threading
+import time
+
+from cache import CachedClient
+from flask import current_app
+from google.api_core.exceptions import Conflict
+from google.auth.transport.requests import AuthorizedSession
+from google.cloud import datastore
+from memory import MemoryClient
+from metrics import InstrumentedClient
+from requests.adapters import HTTPAdapter
+from werkzeug.local import LocalProxy
+
+# "datastore" for Google Cloud Datastore, or "memory" for the in-memory engine
+# used for local runs and benchmarks
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "datastore")
+
+# gRPC multiplexes every call over a single HTTP/2 channel per client. With
+# DATASTORE_USE_GRPC=false calls go over HTTP/1.1 instead, through a pool of
+# DATASTORE_POOL_SIZE connections, roughly one per serving thread
+DATASTORE_USE_GRPC = os.environ.get("DATASTORE_USE_GRPC", "true") == "true"
+DATASTORE_POOL_SIZE = int(os.environ.get("DATASTORE_POOL_SIZE", 16))
+
+# Attempts at a transaction that keeps conflicting with concurrent commits
+TRANSACTION_ATTEMPTS = int(os.environ.get("TRANSACTION_ATTEMPTS", 5))
+
+_lock = threading.Lock()
+
+
+def create_client():
+    # Both backends expose the same subset of the datastore.Client interface:
+    # key, get/get_multi, put/put_multi, delete/delete_multi, allocate_ids,
+    # query with filters, order, projection, limit and cursors, and
+    # transaction
+    if STORAGE_BACKEND == "memory":
+        return CachedClient(InstrumentedClient(MemoryClient()))
+
+    # Credentials are loaded once here and given to the client itself, as
+    # the gRPC channel is built from them rather than from the session
+    if os.environ.get("DATASTORE_EMULATOR_HOST"):
+        credentials, project = None, None
+        session = requests.Session()
+    else:
+        credentials, project = google.auth.default(
+            scopes=datastore.Client.SCOPE)
+        session = AuthorizedSession(credentials)
+
+    if not DATASTORE_USE_GRPC:
+        adapter = HTTPAdapter(pool_connections=DATASTORE_POOL_SIZE,
+                              pool_maxsize=DATASTORE_POOL_SIZE)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+    client = datastore.Client(project=project, credentials=credentials,
+                              _http=session, _use_grpc=DATASTORE_USE_GRPC)
+    return CachedClient(InstrumentedClient(client))
+
+
+def get_client():
+    # The client is built on first use, after any worker processes have been
+    # forked, and then shared by every blueprint of the application
+    extensions = current_app.extensions
+    if "datastore" not in extensions:
+        with _lock:
+            if "datastore" not in extensions:
+                extensions["datastore"] = create_client()
+    return extensions["datastore"]
+
+
+# Work done outside of the request, such as on background threads, needs the
+# object behind the proxy: client._get_current_object()
+client = LocalProxy(get_client)
+
+
+def run_in_transaction(work, attempts=TRANSACTION_ATTEMPTS):
+    # Runs work() in a transaction and returns its result. A commit that
+    # conflicts with another one is retried after a random, growing delay,
+    # so work must do all of its reads inside the transaction
+    for attempt in range(1, attempts + 1):
+        try:
+            with client.transaction():
+                return work()
+        except Conflict:
+            if attempt == attempts:
+                raise
+            time.sleep(random.uniform(0, 0.01 * 2 ** attempt))
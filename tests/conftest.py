@@ -0,0 +1,45 @@
+import hashlib
+import time
+
+import main
+import pytest
+import ratelimit
+import tokens
+
+from cache import CachedClient, EntityCache, NullStore
+from memory import MemoryClient
+
+
+@pytest.fixture
+def engine():
+    return MemoryClient()
+
+
+@pytest.fixture
+def limiter(monkeypatch):
+    # No rate limits or load shedding unless a test asks for them
+    limiter = ratelimit.RateLimiter(None, ratelimit.LIMITS, 0)
+    monkeypatch.setattr(ratelimit, "limiter", limiter)
+    return limiter
+
+
+@pytest.fixture
+def app(engine, limiter):
+    # A fresh app on an empty in-memory engine, without the entity cache
+    app = main.create_app()
+    app.extensions["datastore"] = CachedClient(engine,
+                                               EntityCache(NullStore(), 0))
+    return app
+
+
+@pytest.fixture
+def api(app):
+    return app.test_client()
+
+
+def authorize(sub: str) -> dict:
+    # Headers of a request made with a verified token for the user sub
+    token = "test-" + sub
+    digest = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    tokens.token_cache.put(digest, {"sub": sub, "exp": time.time() + 3600})
+    return {"Authorization": "Bearer " + token, "Accept": "application/json"}
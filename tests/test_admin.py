@@ -0,0 +1,96 @@
+import json
+
+import main
+import models.admin
+import pytest
+
+from cache import CachedClient, EntityCache, NullStore
+from constants import ANIMALS, ICEBERGS, NAMES, USERS
+from google.cloud import datastore
+from memory import MemoryClient
+from names import name_key
+from tests.conftest import authorize
+
+
+@pytest.fixture
+def admin(monkeypatch):
+    monkeypatch.setattr(models.admin, "ADMINS", {"admin"})
+    headers = authorize("admin")
+    headers["Content-Type"] = "application/x-ndjson"
+    return headers
+
+
+def animal_line(animal_id: int, name: str) -> str:
+    return json.dumps({"kind": ANIMALS, "key": animal_id,
+                       "properties": {"name": name, "species": "seal",
+                                      "height": 1, "home": None}}) + "\n"
+
+
+def stored(engine, kind: str) -> dict:
+    return {entity.key.id_or_name: dict(entity)
+            for entity in engine.query(kind=kind).fetch()}
+
+
+def test_export_import_round_trip(api, engine, admin):
+    founder = authorize("founder")
+    iceberg = api.post("/icebergs", headers=founder,
+                       json={"name": "Berg", "area": 10, "shape": "dome",
+                             "public": True}).get_json()
+    animal = api.post("/animals", headers=founder,
+                      json={"name": "Seal", "species": "seal",
+                            "height": 1}).get_json()
+    api.put("/icebergs/%s/animals/%s" % (iceberg["id"], animal["id"]),
+            headers=founder)
+    engine.put(datastore.Entity(key=engine.key(USERS, "founder")))
+
+    exported = api.get("/admin/export", headers=admin).get_data()
+    assert len(exported.splitlines()) == 3
+
+    target = MemoryClient()
+    app = main.create_app()
+    app.extensions["datastore"] = CachedClient(target,
+                                               EntityCache(NullStore(), 0))
+    response = app.test_client().post("/admin/import", data=exported,
+                                      headers=admin)
+    assert response.status_code == 200
+    assert response.get_json() == {"checkpoint": 3, "conflicts": []}
+    for kind in (ICEBERGS, ANIMALS, USERS):
+        assert stored(target, kind) == stored(engine, kind)
+    assert stored(target, NAMES) == {
+        "icebergs:Berg": {"owner": iceberg["id"]},
+        "animals:Seal": {"owner": animal["id"]}}
+
+
+def test_import_resumes_after_a_bad_line(api, engine, admin, monkeypatch):
+    # Two lines per committed batch
+    monkeypatch.setattr(models.admin, "BATCH_SIZE", 5)
+    lines = [animal_line(n, "Seal %d" % n) for n in range(1, 5)]
+    lines[3] = "{}\n"
+
+    response = api.post("/admin/import", data="".join(lines), headers=admin)
+    assert response.status_code == 400
+    assert response.headers["Checkpoint"] == "2"
+    assert sorted(stored(engine, ANIMALS)) == [1, 2]
+
+    lines[3] = animal_line(4, "Seal 4")
+    response = api.post("/admin/import?checkpoint=2", data="".join(lines),
+                        headers=admin)
+    assert response.status_code == 200
+    assert response.get_json() == {"checkpoint": 4, "conflicts": []}
+    assert sorted(stored(engine, ANIMALS)) == [1, 2, 3, 4]
+    assert engine.get(name_key(engine, ANIMALS, "Seal 4"))["owner"] == "4"
+
+
+def test_import_reports_names_owned_by_other_entities(api, engine, admin):
+    reservation = datastore.Entity(key=name_key(engine, ANIMALS, "Taken"))
+    reservation["owner"] = "9"
+    engine.put(reservation)
+    body = (animal_line(1, "Taken") + animal_line(2, "Free")
+            + animal_line(3, "Free"))
+
+    response = api.post("/admin/import", data=body, headers=admin)
+    assert response.status_code == 200
+    assert response.get_json() == {"checkpoint": 3, "conflicts": [1, 3]}
+    assert sorted(stored(engine, ANIMALS)) == [2]
+    assert engine.get(name_key(engine, ANIMALS, "Taken"))["owner"] == "9"
+    assert engine.get(name_key(engine, ANIMALS, "Free"))["owner"] == "2"
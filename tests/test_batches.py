@@ -0,0 +1,55 @@
+import memory
+import pytest
+
+from constants import ANIMALS, BATCH_SIZE, ICEBERGS, NAMES
+from google.cloud import datastore
+from tests.conftest import authorize
+
+
+@pytest.fixture
+def commits(monkeypatch):
+    # Number of writes made by each committed transaction
+    sizes = []
+    exit_ = memory.MemoryTransaction.__exit__
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            sizes.append(len(self.undo))
+        return exit_(self, exc_type, exc_value, traceback)
+    monkeypatch.setattr(memory.MemoryTransaction, "__exit__", __exit__)
+    return sizes
+
+
+def test_batch_commits_fit_the_mutation_limit(api, commits):
+    body = [{"name": "Seal %d" % n, "species": "seal", "height": 1}
+            for n in range(BATCH_SIZE)]
+    response = api.post("/animals/batch", json=body,
+                        headers=authorize("founder"))
+    assert response.status_code == 200
+    assert all(a["status"] == 201 for a in response.get_json()["animals"])
+    assert commits and max(commits) <= BATCH_SIZE
+
+
+@pytest.mark.parametrize("size", [BATCH_SIZE - 3, BATCH_SIZE - 2])
+def test_iceberg_delete_commits_fit_the_mutation_limit(api, engine, commits,
+                                                       size):
+    iceberg = datastore.Entity(key=engine.key(ICEBERGS, 1))
+    iceberg.update({"name": "Berg", "area": 10, "shape": "dome",
+                    "public": True, "founder": "founder",
+                    "inhabitants": [str(n) for n in range(2, size + 2)]})
+    animals = []
+    for n in range(2, size + 2):
+        animal = datastore.Entity(key=engine.key(ANIMALS, n))
+        animal.update({"name": "Seal %d" % n, "species": "seal",
+                       "height": 1, "home": "1"})
+        animals.append(animal)
+    reservation = datastore.Entity(key=engine.key(NAMES, "icebergs:Berg"))
+    reservation["owner"] = "1"
+    engine.put_multi([iceberg, reservation] + animals)
+
+    response = api.delete("/icebergs/1", headers=authorize("founder"))
+    assert response.status_code == 204
+    assert max(commits) <= BATCH_SIZE
+    assert engine.get(engine.key(ICEBERGS, 1)) is None
+    assert all(a["home"] is None
+               for a in engine.get_multi([a.key for a in animals]))
@@ -0,0 +1,126 @@
+import sys
+
+import cache
+import pytest
+
+from cache import CachedClient, EntityCache, MemoryStore
+from google.cloud import datastore
+from memory import MemoryClient
+
+
+class CountingClient(MemoryClient):
+    lookups = 0
+
+    def get_multi(self, keys, **kwargs):
+        self.lookups += 1
+        return super().get_multi(keys, **kwargs)
+
+
+@pytest.fixture
+def engine():
+    engine = CountingClient()
+    for kind in ("animals", "users"):
+        entity = datastore.Entity(key=engine.key(kind, 1))
+        entity["name"] = "Seal"
+        engine.put(entity)
+    return engine
+
+
+@pytest.fixture
+def client(engine):
+    return CachedClient(engine, EntityCache(MemoryStore(100), 60))
+
+
+def test_lookups_read_through(client, engine):
+    key = client.key("animals", 1)
+    assert client.get(key)["name"] == "Seal"
+    assert client.get(key)["name"] == "Seal"
+    assert engine.lookups == 1
+    assert client.cache.stats()["hits"] == 1
+
+    # Missing entities are looked up again every time
+    missing = client.key("animals", 2)
+    assert client.get(missing) is None
+    assert client.get(missing) is None
+    assert engine.lookups == 3
+
+
+def test_only_cached_kinds_are_kept(client, engine):
+    key = client.key("users", 1)
+    client.get(key)
+    client.get(key)
+    assert engine.lookups == 2
+
+
+def test_writes_invalidate(client, engine):
+    key = client.key("animals", 1)
+    animal = client.get(key)
+    animal["name"] = "Walrus"
+    client.put(animal)
+    assert client.get(key)["name"] == "Walrus"
+
+    client.delete(key)
+    assert client.get(key) is None
+
+
+def test_transactions_bypass_the_cache(client, engine):
+    key = client.key("animals", 1)
+    client.get(key)
+    with client.transaction():
+        animal = client.get(key)
+        assert engine.lookups == 2
+        animal["name"] = "Walrus"
+        client.put(animal)
+
+        # A read that fills the cache before the commit is dropped by it
+        client.cache.store.set(client.cache.name(key), animal, 60)
+    assert client.cache.store.get(client.cache.name(key)) is None
+    assert client.get(key)["name"] == "Walrus"
+
+
+def test_write_during_lookup_is_not_overwritten(client, engine):
+    # A lookup that started before a write must not cache what it read
+    key = client.key("animals", 1)
+    stale = engine.get(key)
+    name = client.cache.name(key)
+    token = client.cache.store.lease(name, 10)
+    assert client.cache.store.lease(name, 10) is None
+
+    client.put(engine.get(key))
+    assert not client.cache.store.fill(name, token, stale, 60)
+    assert client.cache.store.get(name) is None
+
+
+def test_memory_store_expires_and_evicts(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "time", lambda: now[0])
+    store = MemoryStore(2)
+    store.set("a", 1, 10)
+    store.set("b", 2, 60)
+    store.get("a")
+    store.set("c", 3, 60)
+    assert (store.get("a"), store.get("b"), store.get("c")) == (1, None, 3)
+    assert store.evictions == 1
+
+    now[0] += 30
+    assert store.get("a") is None
+    assert store.get("c") == 3
+
+
+def test_expired_lease_can_be_taken_again(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "time", lambda: now[0])
+    store = MemoryStore(2)
+    first = store.lease("a", 10)
+    now[0] += 11
+    second = store.lease("a", 10)
+    assert second is not None
+    assert not store.fill("a", first, 1, 60)
+    assert store.fill("a", second, 2, 60)
+    assert store.get("a") == 2
+
+
+def test_missing_redis_package_is_named(monkeypatch):
+    monkeypatch.setitem(sys.modules, "redis", None)
+    with pytest.raises(ImportError, match="pip install redis"):
+        cache.RedisStore("redis://localhost:6379/0")
@@ -0,0 +1,45 @@
+import threading
+
+import concurrency
+import pytest
+import ratelimit
+
+from flask import g, request
+from tests.conftest import authorize
+
+
+@pytest.fixture
+def limiter(monkeypatch):
+    limiter = ratelimit.RateLimiter(None, ratelimit.LIMITS, 64)
+    monkeypatch.setattr(ratelimit, "limiter", limiter)
+    return limiter
+
+
+def test_gathered_calls_share_the_request_and_g(app):
+    with app.test_request_context("/icebergs?limit=3"):
+        g.marker = "request"
+        results = concurrency.gather(lambda: request.args["limit"],
+                                     lambda: request.args["limit"],
+                                     lambda: g.marker)
+    assert results == ["3", "3", "request"]
+
+
+def test_gathered_calls_do_not_tear_down_the_request(app, api, limiter):
+    founder = authorize("founder")
+    response = api.post("/icebergs", json={"name": "Berg", "area": 10,
+                                           "shape": "dome", "public": True},
+                        headers=founder)
+    iceberg_id = response.get_json()["id"]
+
+    teardowns = []
+    in_flight = []
+    app.teardown_request(
+        lambda exc: teardowns.append(threading.current_thread().name))
+    app.after_request(
+        lambda response: in_flight.append(limiter.in_flight) or response)
+
+    assert api.get("/icebergs/" + iceberg_id,
+                   headers=founder).status_code == 200
+    assert teardowns == [threading.current_thread().name]
+    assert in_flight == [1]
+    assert limiter.in_flight == 0
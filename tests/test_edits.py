@@ -0,0 +1,127 @@
+import models.animals
+import models.icebergs
+import pytest
+import storage
+
+from constants import ANIMALS, ICEBERGS
+from google.cloud import datastore
+from names import claim_name, claim_names, name_key
+from tests.conftest import authorize
+
+
+def create(api, path: str, body: dict, headers: dict) -> str:
+    response = api.post(path, json=body, headers=headers)
+    assert response.status_code == 201
+    return response.get_json()["id"]
+
+
+@pytest.fixture
+def founder():
+    return authorize("founder")
+
+
+@pytest.fixture
+def iceberg_id(api, founder):
+    return create(api, "/icebergs", {"name": "Berg", "area": 10,
+                                     "shape": "dome", "public": True},
+                  founder)
+
+
+@pytest.fixture
+def animal_id(api, founder):
+    return create(api, "/animals", {"name": "Seal", "species": "seal",
+                                    "height": 2}, founder)
+
+
+def before_commit(monkeypatch, module, concurrent):
+    # Runs concurrent() after the request has read the entity it edits, but
+    # before its own transaction starts
+    def run_in_transaction(work, **kwargs):
+        monkeypatch.setattr(module, "run_in_transaction",
+                            storage.run_in_transaction)
+        concurrent()
+        return storage.run_in_transaction(work, **kwargs)
+    monkeypatch.setattr(module, "run_in_transaction", run_in_transaction)
+
+
+def move_before_commit(monkeypatch, module, api, founder, iceberg_id,
+                       animal_id):
+    # The Animal is moved onto the Iceberg in the meantime
+    def move():
+        response = api.put("/icebergs/%s/animals/%s" % (iceberg_id,
+                                                        animal_id),
+                           json={}, headers=founder)
+        assert response.status_code == 303
+    before_commit(monkeypatch, module, move)
+
+
+def stored(engine, kind: str, entity_id: str):
+    return engine.get(engine.key(kind, int(entity_id)))
+
+
+@pytest.mark.parametrize("method", ["PUT", "PATCH"])
+def test_animal_edit_keeps_concurrent_move(api, engine, founder, iceberg_id,
+                                           animal_id, monkeypatch, method):
+    move_before_commit(monkeypatch, models.animals, api, founder, iceberg_id,
+                       animal_id)
+    response = api.open("/animals/" + animal_id, method=method,
+                        json={"name": "Walrus", "species": "walrus",
+                              "height": 3}, headers=founder)
+    assert response.status_code == 303
+
+    animal = stored(engine, ANIMALS, animal_id)
+    assert animal["name"] == "Walrus"
+    assert animal["home"] == iceberg_id
+    assert stored(engine, ICEBERGS, iceberg_id)["inhabitants"] == [animal_id]
+
+
+@pytest.mark.parametrize("method", ["PUT", "PATCH"])
+def test_iceberg_edit_keeps_concurrent_move(api, engine, founder, iceberg_id,
+                                            animal_id, monkeypatch, method):
+    move_before_commit(monkeypatch, models.icebergs, api, founder,
+                       iceberg_id, animal_id)
+    response = api.open("/icebergs/" + iceberg_id, method=method,
+                        json={"name": "Floe", "area": 20, "shape": "wedge",
+                              "public": False}, headers=founder)
+    assert response.status_code == 303
+
+    iceberg = stored(engine, ICEBERGS, iceberg_id)
+    assert iceberg["name"] == "Floe"
+    assert iceberg["inhabitants"] == [animal_id]
+    assert stored(engine, ANIMALS, animal_id)["home"] == iceberg_id
+
+
+def test_edit_releases_the_name_as_stored(api, engine, founder, animal_id,
+                                          monkeypatch):
+    # The Animal is renamed and another one takes its old name after the
+    # request has read it
+    def rename():
+        assert api.patch("/animals/" + animal_id, json={"name": "Otter"},
+                         headers=founder).status_code == 303
+        create(api, "/animals", {"name": "Seal", "species": "seal",
+                                 "height": 1}, founder)
+    before_commit(monkeypatch, models.animals, rename)
+
+    response = api.patch("/animals/" + animal_id, json={"name": "Walrus"},
+                         headers=founder)
+    assert response.status_code == 303
+
+    names = {key: engine.get(name_key(engine, ANIMALS, key))
+             for key in ("Seal", "Otter", "Walrus")}
+    assert names["Seal"]["owner"] != animal_id
+    assert names["Otter"] is None
+    assert names["Walrus"]["owner"] == animal_id
+
+
+def test_claim_name_keeps_a_reservation_owned_by_another(engine):
+    first, second = (engine.key(ANIMALS, n) for n in (1, 2))
+    other = datastore.Entity(key=second)
+    other["name"] = "Seal"
+    assert claim_names(engine, [other]) == [other]
+
+    renamed = datastore.Entity(key=first)
+    renamed["name"] = "Walrus"
+    with engine.transaction():
+        assert claim_name(engine, renamed, "Seal")
+    reservation = engine.get(name_key(engine, ANIMALS, "Seal"))
+    assert reservation["owner"] == "2"
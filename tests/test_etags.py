@@ -0,0 +1,80 @@
+import gzip
+
+import helpers
+import pytest
+
+from tests.conftest import authorize
+
+
+@pytest.fixture
+def animal_path(api, monkeypatch):
+    monkeypatch.setattr(helpers, "COMPRESS_MIN_SIZE", 0)
+    response = api.post("/animals", json={"name": "Seal", "species": "seal",
+                                          "height": 2},
+                        headers=authorize("founder"))
+    return "/animals/" + response.get_json()["id"]
+
+
+def test_compressed_body_has_its_own_etag(api, animal_path):
+    plain = api.get(animal_path, headers={"Accept": "application/json"})
+    packed = api.get(animal_path, headers={"Accept": "application/json",
+                                           "Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in plain.headers
+    assert packed.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(packed.get_data()) == plain.get_data()
+    assert packed.get_etag() == (plain.get_etag()[0] + "-gzip", False)
+
+
+@pytest.mark.parametrize("encoding", ["identity", "gzip"])
+def test_either_etag_names_the_version(api, animal_path, encoding):
+    headers = {"Accept": "application/json", "Accept-Encoding": encoding}
+    etag = api.get(animal_path, headers=headers).headers["ETag"]
+
+    # The same version in the other encoding is not modified either
+    other = "gzip" if encoding == "identity" else "identity"
+    response = api.get(animal_path, headers={
+        "Accept": "application/json", "Accept-Encoding": other,
+        "If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+
+    response = api.patch(animal_path, json={"height": 3},
+                         headers=dict(headers, **{"If-Match": etag}))
+    assert response.status_code == 303
+    response = api.patch(animal_path, json={"height": 4},
+                         headers=dict(headers, **{"If-Match": etag}))
+    assert response.status_code == 412
+
+
+def test_etag_depends_on_the_host(api, animal_path):
+    headers = {"Accept": "application/json"}
+    etag = api.get(animal_path, headers=headers).headers["ETag"]
+    response = api.get(animal_path, base_url="https://other.example",
+                       headers=dict(headers, **{"If-None-Match": etag}))
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert response.get_json()["self"].startswith("https://other.example/")
+
+
+def test_current_etag_is_not_modified(api, animal_path):
+    headers = {"Accept": "application/json"}
+    etag = api.get(animal_path, headers=headers).headers["ETag"]
+    response = api.get(animal_path,
+                       headers=dict(headers, **{"If-None-Match": etag}))
+    assert response.status_code == 304
+    assert response.get_data() == b""
+
+
+@pytest.mark.parametrize("method, body", [
+    ("GET", None),
+    ("PUT", {"name": "Seal", "species": "seal", "height": 5}),
+    ("PATCH", {"height": 5})])
+def test_stale_if_match_fails(api, animal_path, method, body):
+    headers = {"Accept": "application/json"}
+    stale = api.get(animal_path, headers=headers).headers["ETag"]
+    api.patch(animal_path, json={"height": 4}, headers=headers)
+
+    response = api.open(animal_path, method=method, json=body,
+                        headers=dict(headers, **{"If-Match": stale}))
+    assert response.status_code == 412
+    assert api.get(animal_path, headers=headers).get_json()["height"] == 4
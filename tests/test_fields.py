@@ -0,0 +1,65 @@
+import pytest
+
+from constants import ANIMAL_ORDERS, ANIMALS, ICEBERG_ORDERS, ICEBERGS
+from helpers import add_filters, add_order, project_fields
+from memory import MemoryClient
+from tests.conftest import authorize
+
+
+def projection(app, kind, path, fields, indexed, equals=()):
+    # The properties a list query would project for path
+    with app.test_request_context(path):
+        query = MemoryClient().query(kind=kind)
+        for prop, value in equals:
+            query.add_filter(prop, "=", value)
+        add_filters(query, {"shape": str, "species": str},
+                    ("area", "height"))
+        add_order(query, ICEBERG_ORDERS + ANIMAL_ORDERS)
+        project_fields(query, fields, indexed)
+        return query.projection
+
+
+@pytest.mark.parametrize("path, fields, expected", [
+    ("/", ["id", "name"], ["name"]),
+    ("/", ["id", "shape"], ["shape"]),
+    ("/", ["name", "area"], []),
+    ("/", ["public"], []),
+    ("/", ["inhabitants"], []),
+    ("/", ["founder", "self"], ["__key__"]),
+    ("/?shape=dome", ["shape", "area"], ["area"]),
+    ("/?order=-area", ["area"], ["area"]),
+    ("/?order=name", ["area"], []),
+    ("/?min_area=5", ["name"], []),
+])
+def test_iceberg_projections_have_indexes(app, path, fields, expected):
+    assert projection(app, ICEBERGS, path, fields, ICEBERG_ORDERS,
+                      [("founder", "user0")]) == expected
+
+
+@pytest.mark.parametrize("path, fields, expected", [
+    ("/", ["home"], ["home"]),
+    ("/", ["name", "height"], []),
+    ("/?species=seal", ["home"], []),
+    ("/?species=seal", ["height"], ["height"]),
+    ("/?min_height=2", ["name"], []),
+])
+def test_animal_projections_have_indexes(app, path, fields, expected):
+    assert projection(app, ANIMALS, path, fields, ANIMAL_ORDERS) == expected
+
+
+def test_wide_selection_is_trimmed(api):
+    founder = authorize("founder")
+    for n, shape in enumerate(["dome", "wedge"]):
+        response = api.post("/icebergs", json={"name": "Berg %d" % n,
+                                               "area": n + 10,
+                                               "shape": shape,
+                                               "public": True},
+                            headers=founder)
+        assert response.status_code == 201
+
+    response = api.get("/icebergs?fields=name,area,founder&order=-area",
+                       headers=founder)
+    assert response.status_code == 200
+    assert response.get_json()["icebergs"] == [
+        {"name": "Berg 1", "area": 11, "founder": "founder"},
+        {"name": "Berg 0", "area": 10, "founder": "founder"}]
@@ -0,0 +1,46 @@
+import pytest
+
+from constants import ICEBERGS
+from google.cloud import datastore
+from migrations import lower_shapes
+from tests.conftest import authorize
+
+
+@pytest.fixture
+def founder(api):
+    founder = authorize("founder")
+    for n, shape in enumerate(["DOME", "Wedge", "dome"]):
+        response = api.post("/icebergs", json={"name": "Berg %d" % n,
+                                               "area": 10, "shape": shape,
+                                               "public": True},
+                            headers=founder)
+        assert response.status_code == 201
+        assert response.get_json()["shape"] == shape.lower()
+    return founder
+
+
+@pytest.mark.parametrize("shape", ["dome", "DOME", "Dome"])
+def test_shape_filter_ignores_case(api, founder, shape):
+    response = api.get("/icebergs?fields=name&shape=" + shape,
+                       headers=founder)
+    assert response.status_code == 200
+    assert response.get_json()["icebergs"] == [{"name": "Berg 0"},
+                                               {"name": "Berg 2"}]
+
+
+def test_unknown_shape_is_rejected(api, founder):
+    response = api.get("/icebergs?shape=cube", headers=founder)
+    assert response.status_code == 400
+
+
+def test_lower_shapes(engine):
+    icebergs = []
+    for n, shape in enumerate(["DOME", "wedge"], 1):
+        iceberg = datastore.Entity(key=engine.key(ICEBERGS, n))
+        iceberg["shape"] = shape
+        icebergs.append(iceberg)
+    engine.put_multi(icebergs)
+
+    lower_shapes(engine, batch_size=1)
+    stored = engine.get_multi([iceberg.key for iceberg in icebergs])
+    assert [iceberg["shape"] for iceberg in stored] == ["dome", "wedge"]
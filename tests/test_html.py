@@ -0,0 +1,18 @@
+import serializers
+
+from cache import MemoryStore
+from tests.conftest import authorize
+
+
+def test_cached_pages_link_to_their_own_host(api, monkeypatch):
+    monkeypatch.setattr(serializers, "html_cache", MemoryStore(10))
+    response = api.post("/animals", json={"name": "Seal", "species": "seal",
+                                          "height": 2},
+                        headers=authorize("founder"))
+    path = "/animals/" + response.get_json()["id"]
+
+    for host in ("one.example", "two.example", "one.example"):
+        page = api.get(path, base_url="http://" + host,
+                       headers={"Accept": "text/html"}).get_data(as_text=True)
+        assert "http://%s%s" % (host, path) in page
+    assert serializers.html_cache.size() == 2
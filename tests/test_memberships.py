@@ -0,0 +1,96 @@
+import errors as ERR
+import pytest
+
+from constants import ANIMALS, BATCH_SIZE, ICEBERGS
+from google.cloud import datastore
+from tests.conftest import authorize
+
+
+@pytest.fixture
+def founder():
+    return authorize("founder")
+
+
+@pytest.fixture
+def icebergs(engine):
+    # Iceberg 1 is empty and Animal 4 lives on Iceberg 2; Animals 3 and 5 are
+    # free
+    entities = []
+    for iceberg_id, inhabitants in [(1, None), (2, ["4"])]:
+        iceberg = datastore.Entity(key=engine.key(ICEBERGS, iceberg_id))
+        iceberg.update({"name": "Berg %d" % iceberg_id, "area": 10,
+                        "shape": "dome", "public": True,
+                        "founder": "founder", "inhabitants": inhabitants})
+        entities.append(iceberg)
+    for animal_id, home in [(3, None), (4, "2"), (5, None)]:
+        animal = datastore.Entity(key=engine.key(ANIMALS, animal_id))
+        animal.update({"name": "Seal %d" % animal_id, "species": "seal",
+                       "height": 1, "home": home})
+        entities.append(animal)
+    engine.put_multi(entities)
+
+
+@pytest.fixture
+def writes(engine, monkeypatch):
+    # Entities passed to each put_multi
+    calls = []
+    put_multi = engine.put_multi
+
+    def record(entities, **kwargs):
+        calls.append([entity.key for entity in entities])
+        return put_multi(entities, **kwargs)
+    monkeypatch.setattr(engine, "put_multi", record)
+    return calls
+
+
+def test_put_reports_each_animal(api, engine, icebergs, founder, writes):
+    response = api.put("/icebergs/1/animals", headers=founder,
+                       json={"animals": [3, 4, 99, "seal", 5, 3]})
+    assert response.status_code == 200
+    assert response.get_json()["animals"] == [
+        {"id": "3", "status": 200},
+        {"id": "4", "status": 400, "Error": ERR.ANIMAL_ASSIGNED},
+        {"id": "99", "status": 404, "Error": ERR.NO_ANIMAL},
+        {"id": "seal", "status": 404, "Error": ERR.NO_ANIMAL},
+        {"id": "5", "status": 200}]
+
+    # The Iceberg and both moved Animals are written together
+    assert writes == [[engine.key(ICEBERGS, 1), engine.key(ANIMALS, 3),
+                       engine.key(ANIMALS, 5)]]
+    assert engine.get(engine.key(ICEBERGS, 1))["inhabitants"] == ["3", "5"]
+    assert engine.get(engine.key(ANIMALS, 4))["home"] == "2"
+
+
+def test_delete_reports_each_animal(api, engine, icebergs, founder, writes):
+    response = api.delete("/icebergs/2/animals", headers=founder,
+                          json={"animals": [3, 4, 99]})
+    assert response.status_code == 200
+    assert response.get_json()["animals"] == [
+        {"id": "3", "status": 404, "Error": ERR.NO_ANIMAL_HERE},
+        {"id": "4", "status": 200},
+        {"id": "99", "status": 404, "Error": ERR.NO_ANIMAL}]
+    assert writes == [[engine.key(ICEBERGS, 2), engine.key(ANIMALS, 4)]]
+    assert engine.get(engine.key(ICEBERGS, 2))["inhabitants"] is None
+    assert engine.get(engine.key(ANIMALS, 4))["home"] is None
+
+
+def test_nothing_is_written_without_changes(api, icebergs, founder, writes):
+    response = api.delete("/icebergs/1/animals", headers=founder,
+                          json={"animals": [3]})
+    assert response.status_code == 200
+    assert writes == []
+
+
+def test_missing_iceberg(api, icebergs, founder):
+    response = api.put("/icebergs/9/animals", headers=founder,
+                       json={"animals": [3]})
+    assert response.status_code == 404
+    assert response.get_json()["Error"] == ERR.NO_ICEBERG
+
+
+@pytest.mark.parametrize("size, status", [
+    (BATCH_SIZE - 1, 200), (BATCH_SIZE, 400)])
+def test_animals_fit_one_commit(api, icebergs, founder, size, status):
+    response = api.put("/icebergs/1/animals", headers=founder,
+                       json={"animals": list(range(100, 100 + size))})
+    assert response.status_code == status
@@ -0,0 +1,147 @@
+import pytest
+
+from google.cloud import datastore
+from memory import MemoryClient
+
+SPECIES = ["seal", "walrus", "penguin"]
+
+
+@pytest.fixture
+def engine():
+    engine = MemoryClient()
+    animals = []
+    for n in range(1, 11):
+        animal = datastore.Entity(key=engine.key("animals", n))
+        animal.update({"name": "Animal %d" % n,
+                       "species": SPECIES[n % 3],
+                       "height": n % 4,
+                       "tags": ["even" if n % 2 == 0 else "odd"]})
+        animals.append(animal)
+    engine.put_multi(animals)
+    return engine
+
+
+def ids(entities) -> list:
+    return [entity.key.id for entity in entities]
+
+
+def fetch(engine, *filters, **kwargs):
+    query = engine.query(kind="animals")
+    for prop, op, value in filters:
+        query.add_filter(prop, op, value)
+    return list(query.fetch(**kwargs))
+
+
+def pages(query, limit: int) -> list:
+    # Every page of the query, following next_page_token
+    found = []
+    cursor = None
+    while True:
+        iterator = query.fetch(limit=limit, start_cursor=cursor)
+        found.append(ids(next(iterator.pages)))
+        cursor = iterator.next_page_token
+        if cursor is None:
+            return found
+
+
+def test_equality_filters_use_current_values(engine):
+    assert ids(fetch(engine, ("species", "=", "walrus"))) == [1, 4, 7, 10]
+
+    animal = engine.get(engine.key("animals", 4))
+    animal["species"] = "seal"
+    engine.put(animal)
+    engine.delete(engine.key("animals", 7))
+
+    assert ids(fetch(engine, ("species", "=", "walrus"))) == [1, 10]
+    assert ids(fetch(engine, ("species", "=", "seal"))) == [3, 4, 6, 9]
+
+
+def test_filters_combine(engine):
+    assert ids(fetch(engine, ("species", "=", "seal"),
+                     ("height", ">=", 2))) == [3, 6]
+    assert ids(fetch(engine, ("height", "<", 1))) == [4, 8]
+    assert ids(fetch(engine, ("tags", "=", "even"),
+                     ("species", "=", "walrus"))) == [4, 10]
+    assert fetch(engine, ("species", "=", "orca")) == []
+
+
+def test_unsorted_pages_follow_key_order(engine):
+    query = engine.query(kind="animals")
+    assert pages(query, 4) == [[1, 2, 3, 4], [5, 6, 7, 8], [9, 10]]
+    assert ids(query.fetch(limit=3, offset=8)) == [9, 10]
+
+
+def test_cursor_skips_entities_deleted_since(engine):
+    iterator = engine.query(kind="animals").fetch(limit=3)
+    assert ids(next(iterator.pages)) == [1, 2, 3]
+    engine.delete(engine.key("animals", 4))
+
+    query = engine.query(kind="animals")
+    page = query.fetch(limit=3, start_cursor=iterator.next_page_token)
+    assert ids(page) == [5, 6, 7]
+
+
+def test_sorted_pages(engine):
+    query = engine.query(kind="animals", order=["-height", "name"])
+    assert pages(query, 4) == [[3, 7, 10, 2], [6, 1, 5, 9], [4, 8]]
+
+    query = engine.query(kind="animals", order=["height"])
+    query.add_filter("species", "=", "walrus")
+    assert pages(query, 2) == [[4, 1], [10, 7]]
+
+
+def test_projections(engine):
+    query = engine.query(kind="animals", projection=["name"])
+    assert [dict(entity) for entity in query.fetch(limit=2)] == [
+        {"name": "Animal 1"}, {"name": "Animal 2"}]
+
+    query = engine.query(kind="animals")
+    query.keys_only()
+    found = list(query.fetch(limit=2))
+    assert ids(found) == [1, 2]
+    assert [dict(entity) for entity in found] == [{}, {}]
+
+
+def test_entities_are_copied(engine):
+    animal = engine.get(engine.key("animals", 1))
+    animal["species"] = "orca"
+    assert engine.get(engine.key("animals", 1))["species"] == "walrus"
+
+
+def test_transaction_rolls_back(engine):
+    with pytest.raises(RuntimeError):
+        with engine.transaction():
+            animal = engine.get(engine.key("animals", 1))
+            animal["species"] = "orca"
+            engine.put(animal)
+            engine.delete(engine.key("animals", 2))
+            created = datastore.Entity(key=engine.key("animals"))
+            created.update({"name": "New", "species": "orca"})
+            engine.put(created)
+            raise RuntimeError
+
+    assert engine.get(engine.key("animals", 1))["species"] == "walrus"
+    assert engine.get(engine.key("animals", 2)) is not None
+    assert fetch(engine, ("species", "=", "orca")) == []
+    assert ids(fetch(engine, ("species", "=", "walrus"))) == [1, 4, 7, 10]
+    assert len(fetch(engine)) == 10
+
+
+def test_allocated_ids_are_unique(engine):
+    key = engine.key("animals")
+    allocated = engine.allocate_ids(key, 3)
+    created = datastore.Entity(key=key)
+    engine.put(created)
+    assert len({k.id for k in allocated} | {created.key.id}) == 4
+
+
+def test_new_ids_follow_complete_keys(engine):
+    # The fixture wrote ids 1 to 10 with complete keys
+    created = datastore.Entity(key=engine.key("icebergs"))
+    engine.put(created)
+    assert created.key.id == 11
+    assert engine.get(engine.key("animals", 1))["name"] == "Animal 1"
+
+    imported = datastore.Entity(key=engine.key("icebergs", 50))
+    engine.put(imported)
+    assert engine.allocate_ids(engine.key("icebergs"), 1)[0].id == 51
@@ -0,0 +1,116 @@
+import threading
+
+import pytest
+import ratelimit
+
+from ratelimit import MemoryBuckets, RateLimiter
+from tests.conftest import authorize
+
+LIMITS = {"read": "1/2", "write": "1/1", "admin": "1/1"}
+
+
+@pytest.fixture
+def limiter(monkeypatch):
+    # One read a second with a burst of two, at most two requests at once,
+    # and requests trusted to come through one proxy
+    limiter = RateLimiter(MemoryBuckets(100), LIMITS, 2)
+    monkeypatch.setattr(ratelimit, "limiter", limiter)
+    monkeypatch.setattr(ratelimit, "PROXY_HOPS", 1)
+    return limiter
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(ratelimit.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_bucket_refills_at_its_rate(clock):
+    buckets = MemoryBuckets(100)
+    assert [buckets.take("a", 2, 3) for _ in range(3)] == [0, 0, 0]
+    assert buckets.take("a", 2, 3) == pytest.approx(0.5)
+    assert buckets.take("b", 2, 3) == 0
+
+    clock[0] += 1
+    assert [buckets.take("a", 2, 3) for _ in range(2)] == [0, 0]
+    assert buckets.take("a", 2, 3) > 0
+
+
+def test_idle_buckets_are_dropped(clock):
+    buckets = MemoryBuckets(2)
+    for name in ("a", "b", "c"):
+        buckets.take(name, 1, 1)
+    assert buckets.take("a", 1, 1) == 0
+    assert buckets.take("c", 1, 1) > 0
+
+
+def test_anonymous_callers_are_keyed_on_the_forwarded_address(api, clock):
+    def get(client_addr):
+        return api.get("/animals", environ_base={"REMOTE_ADDR": "10.0.0.1"},
+                       headers={"X-Forwarded-For": client_addr})
+
+    assert [get("1.1.1.1").status_code for _ in range(3)] == [200, 200, 429]
+    assert get("2.2.2.2").status_code == 200
+
+
+def test_users_are_limited_separately(api, clock):
+    statuses = [api.get("/animals", headers=authorize(user)).status_code
+                for user in ("a", "a", "a", "b")]
+    assert statuses == [200, 200, 429, 200]
+
+    response = api.get("/animals", headers=authorize("a"))
+    assert response.headers["Retry-After"] == "1"
+    clock[0] += 1
+    assert api.get("/animals", headers=authorize("a")).status_code == 200
+
+
+def test_load_is_shed_beyond_max_in_flight(api, limiter):
+    limiter.in_flight = 2
+    response = api.get("/animals")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert limiter.stats() == {"in_flight": 2, "limited": 0, "shed": 1}
+
+    # Requests that are served or limited give their slot back
+    limiter.in_flight = 1
+    assert api.get("/animals").status_code == 200
+    assert limiter.in_flight == 1
+
+
+def test_exempt_routes_are_not_limited(api, limiter):
+    limiter.in_flight = 2
+    assert api.get("/metrics").status_code == 200
+
+
+def test_token_is_not_checked_without_limits(api, limiter, monkeypatch):
+    checked = []
+    monkeypatch.setattr(ratelimit, "verify_jwt", lambda: checked.append(1))
+    limiter.buckets = None
+    assert api.get("/animals", headers=authorize("a")).status_code == 200
+    assert checked == []
+
+
+def test_spare_threads_shed_load(app, engine, monkeypatch):
+    # With every gunicorn thread busy, those beyond MAX_IN_FLIGHT answer 503
+    assert 0 < ratelimit.MAX_IN_FLIGHT < ratelimit.THREADS
+    limiter = RateLimiter(None, LIMITS, ratelimit.MAX_IN_FLIGHT)
+    monkeypatch.setattr(ratelimit, "limiter", limiter)
+    engine.latency = 0.1
+
+    barrier = threading.Barrier(ratelimit.THREADS)
+    statuses = []
+
+    def request():
+        api = app.test_client()
+        barrier.wait()
+        statuses.append(api.get("/animals").status_code)
+
+    threads = [threading.Thread(target=request)
+               for _ in range(ratelimit.THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert statuses.count(503) == ratelimit.THREADS - ratelimit.MAX_IN_FLIGHT
+    assert limiter.in_flight == 0
@@ -0,0 +1,115 @@
+import datetime
+import json
+import time
+
+import pytest
+import tokens
+
+from constants import CLIENT_ID
+from google.auth import crypt, jwt
+
+# The certificate stub is generated with cryptography, which google-auth only
+# needs as an optional extra
+pytest.importorskip("cryptography")
+
+from cryptography import x509  # noqa: E402
+from cryptography.hazmat.primitives import hashes, serialization  # noqa
+from cryptography.hazmat.primitives.asymmetric import rsa  # noqa: E402
+from cryptography.x509.oid import NameOID  # noqa: E402
+
+KEY_ID = "local"
+
+
+class CertResponse:
+    # The parts of a requests.Response that google-auth reads
+    def __init__(self, body: bytes, cache_control: str):
+        self.status_code = 200
+        self.headers = {"Cache-Control": cache_control}
+        self.content = body
+
+
+class CertSession:
+    # Stands in for Google's certificate endpoint and counts every request
+    def __init__(self, certificate: bytes, cache_control="max-age=3600"):
+        self.body = json.dumps({KEY_ID: certificate.decode()}).encode()
+        self.cache_control = cache_control
+        self.requests = 0
+
+    def request(self, method, url, **kwargs):
+        self.requests += 1
+        return CertResponse(self.body, self.cache_control)
+
+    def close(self):
+        pass
+
+
+@pytest.fixture(scope="module")
+def signing_key():
+    # A throwaway key and the self-signed certificate published for it
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "local")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (x509.CertificateBuilder()
+                   .subject_name(name)
+                   .issuer_name(name)
+                   .public_key(key.public_key())
+                   .serial_number(x509.random_serial_number())
+                   .not_valid_before(now - datetime.timedelta(days=1))
+                   .not_valid_after(now + datetime.timedelta(days=1))
+                   .sign(key, hashes.SHA256()))
+    private = key.private_bytes(serialization.Encoding.PEM,
+                                serialization.PrivateFormat.PKCS8,
+                                serialization.NoEncryption())
+    signer = crypt.RSASigner.from_string(private, key_id=KEY_ID)
+    return signer, certificate.public_bytes(serialization.Encoding.PEM)
+
+
+def id_token(signer, sub: str) -> str:
+    now = int(time.time())
+    payload = {"iss": "https://accounts.google.com", "aud": CLIENT_ID,
+               "sub": sub, "iat": now, "exp": now + 3600}
+    return jwt.encode(signer, payload).decode()
+
+
+@pytest.fixture
+def cert_session(signing_key, monkeypatch):
+    session = CertSession(signing_key[1])
+    monkeypatch.setattr(tokens, "cert_request",
+                        tokens.CachingRequest(session=session))
+    monkeypatch.setattr(tokens, "token_cache", tokens.TokenCache(16))
+    return session
+
+
+def test_repeated_token_makes_no_network_requests(signing_key, cert_session):
+    token = id_token(signing_key[0], "user0")
+    assert tokens.verify_token(token)["sub"] == "user0"
+    assert cert_session.requests == 1
+
+    for _ in range(10):
+        assert tokens.verify_token(token)["sub"] == "user0"
+    assert cert_session.requests == 1
+    assert tokens.token_cache.stats() == {"hits": 10, "misses": 1,
+                                          "size": 1}
+
+
+def test_new_tokens_reuse_cached_certificates(signing_key, cert_session):
+    for n in range(3):
+        token = id_token(signing_key[0], "user%d" % n)
+        assert tokens.verify_token(token)["sub"] == "user%d" % n
+    assert cert_session.requests == 1
+    assert tokens.token_cache.stats()["misses"] == 3
+
+
+def test_uncacheable_certificates_are_fetched_again(signing_key,
+                                                    cert_session):
+    cert_session.cache_control = "no-cache"
+    for n in range(2):
+        tokens.verify_token(id_token(signing_key[0], "user%d" % n))
+    assert cert_session.requests == 2
+
+
+def test_invalid_token_is_rejected(signing_key, cert_session):
+    token = id_token(signing_key[0], "user0")
+    with pytest.raises(ValueError):
+        tokens.verify_token(token[:-4] + "AAAA")
+    assert tokens.token_cache.stats()["size"] == 0
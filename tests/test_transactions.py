@@ -0,0 +1,98 @@
+import memory
+import pytest
+
+from constants import ANIMALS, ICEBERGS, USERS
+from counters import read_totals
+from google.api_core.exceptions import Conflict
+from models.users import get_or_create_user
+from names import name_key
+from tests.conftest import authorize
+
+
+@pytest.fixture
+def conflicts(monkeypatch):
+    # The next commits given by conflicts[0] are aborted as Datastore aborts
+    # one of two transactions that touch the same entity
+    remaining = [0]
+    exit_ = memory.MemoryTransaction.__exit__
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None and remaining[0]:
+            remaining[0] -= 1
+            exit_(self, Conflict, Conflict("aborted"), None)
+            raise Conflict("aborted")
+        return exit_(self, exc_type, exc_value, traceback)
+    monkeypatch.setattr(memory.MemoryTransaction, "__exit__", __exit__)
+    return remaining
+
+
+@pytest.fixture
+def founder():
+    return authorize("founder")
+
+
+def test_create_is_retried(api, engine, conflicts, founder):
+    conflicts[0] = 1
+    response = api.post("/animals", json={"name": "Seal", "species": "seal",
+                                          "height": 1}, headers=founder)
+    assert response.status_code == 201
+    animal_id = response.get_json()["id"]
+    assert engine.get(name_key(engine, ANIMALS, "Seal"))["owner"] == animal_id
+    assert read_totals(engine)["animals"] == 1
+
+
+def test_batch_create_is_retried(api, engine, conflicts, founder):
+    conflicts[0] = 1
+    body = [{"name": "Berg %d" % n, "area": 1, "shape": "dome",
+             "public": True} for n in range(3)]
+    response = api.post("/icebergs/batch", json=body, headers=founder)
+    assert response.status_code == 200
+    assert [i["status"] for i in response.get_json()["icebergs"]] == [201] * 3
+    assert read_totals(engine)["icebergs"] == 3
+
+
+def test_iceberg_delete_is_retried(api, engine, conflicts, founder):
+    response = api.post("/icebergs", json={"name": "Berg", "area": 1,
+                                           "shape": "dome", "public": True},
+                        headers=founder)
+    iceberg_id = response.get_json()["id"]
+
+    conflicts[0] = 1
+    response = api.delete("/icebergs/" + iceberg_id, headers=founder)
+    assert response.status_code == 204
+    assert engine.get(engine.key(ICEBERGS, int(iceberg_id))) is None
+    assert engine.get(name_key(engine, ICEBERGS, "Berg")) is None
+    assert read_totals(engine)["icebergs"] == 0
+
+
+def test_repeated_conflicts_fail(api, engine, conflicts, founder):
+    conflicts[0] = 100
+    response = api.post("/animals", json={"name": "Seal", "species": "seal",
+                                          "height": 1}, headers=founder)
+    assert response.status_code == 500
+    assert engine.get(name_key(engine, ANIMALS, "Seal")) is None
+
+
+def test_first_login_is_retried(app, engine, conflicts):
+    conflicts[0] = 1
+    with app.app_context():
+        user = get_or_create_user("sub1")
+    assert user.key == engine.key(USERS, "sub1")
+    assert engine.get(user.key) == {"id": "sub1"}
+
+
+def test_bulk_membership_is_retried(api, engine, conflicts, founder):
+    iceberg = api.post("/icebergs", headers=founder,
+                       json={"name": "Berg", "area": 10, "shape": "dome",
+                             "public": True}).get_json()
+    animal = api.post("/animals", headers=founder,
+                      json={"name": "Seal", "species": "seal",
+                            "height": 1}).get_json()
+    conflicts[0] = 1
+    response = api.put("/icebergs/%s/animals" % iceberg["id"],
+                       json={"animals": [animal["id"]]}, headers=founder)
+    assert response.status_code == 200
+    assert response.get_json()["animals"] == [{"id": animal["id"],
+                                               "status": 200}]
+    stored = engine.get(engine.key(ICEBERGS, int(iceberg["id"])))
+    assert stored["inhabitants"] == [animal["id"]]
@@ -0,0 +1,37 @@
+from constants import USERS
+from google.cloud import datastore
+from migrations import rekey_users
+from models.users import get_or_create_user
+
+
+def test_first_login_creates_the_user(app, engine):
+    with app.app_context():
+        user = get_or_create_user("sub1")
+    assert user.key == engine.key(USERS, "sub1")
+    assert engine.get(engine.key(USERS, "sub1")) == {"id": "sub1"}
+
+
+def test_later_logins_keep_the_user(app, engine):
+    user = datastore.Entity(key=engine.key(USERS, "sub1"))
+    user.update({"id": "sub1", "icebergs": 2})
+    engine.put(user)
+    with app.app_context():
+        assert get_or_create_user("sub1") == user
+    assert list(engine.query(kind=USERS).fetch()) == [user]
+
+
+def test_rekey_users_names_keys_after_sub(engine):
+    users = []
+    for n in range(5):
+        user = datastore.Entity(key=engine.key(USERS))
+        user.update({"id": "sub%d" % n})
+        users.append(user)
+    named = datastore.Entity(key=engine.key(USERS, "sub9"))
+    named.update({"id": "sub9"})
+    engine.put_multi(users + [named])
+
+    rekey_users(engine, batch_size=2)
+    stored = {user.key.id_or_name: dict(user)
+              for user in engine.query(kind=USERS).fetch()}
+    assert stored == {"sub%d" % n: {"id": "sub%d" % n}
+                      for n in [0, 1, 2, 3, 4, 9]}
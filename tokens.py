@@ -0,0 +1,102 @@
+import hashlib
+import os
+import re
+import threading
+import time
+
+from collections import OrderedDict
+from constants import CLIENT_ID
+from google.auth import transport
+from google.auth.transport import requests
+from google.oauth2 import id_token
+
+import requests as http
+
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", 4096))
+
+
+class CachingRequest(transport.Request):
+    # Transport for google-auth that reuses pooled connections and keeps GET
+    # responses, such as Google's signing certificates, for as long as their
+    # Cache-Control header allows
+    def __init__(self, session=None):
+        self._request = requests.Request(session=session or http.Session())
+        self._responses = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, url, method="GET", body=None, headers=None,
+                 timeout=None, **kwargs):
+        if method != "GET":
+            return self._request(url, method=method, body=body,
+                                 headers=headers, timeout=timeout, **kwargs)
+
+        now = time.time()
+        with self._lock:
+            cached = self._responses.get(url)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+
+        response = self._request(url, method=method, headers=headers,
+                                 timeout=timeout, **kwargs)
+        max_age = cache_max_age(response.headers.get("Cache-Control", ""))
+        if response.status == 200 and max_age > 0:
+            with self._lock:
+                self._responses[url] = (now + max_age, response)
+        return response
+
+
+def cache_max_age(cache_control: str) -> int:
+    if "no-store" in cache_control or "no-cache" in cache_control:
+        return 0
+    match = re.search(r"max-age=(\d+)", cache_control)
+    return int(match.group(1)) if match else 0
+
+
+class TokenCache:
+    # LRU of verified ID tokens keyed by their SHA-256 digest; an entry is
+    # only served until the token's own "exp" claim
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, digest: str):
+        with self._lock:
+            id_info = self._entries.get(digest)
+            if id_info is not None and id_info["exp"] > time.time():
+                self._entries.move_to_end(digest)
+                self.hits += 1
+                return id_info
+            if id_info is not None:
+                del self._entries[digest]
+            self.misses += 1
+            return None
+
+    def put(self, digest: str, id_info: dict):
+        with self._lock:
+            self._entries[digest] = id_info
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "size": len(self._entries)}
+
+
+cert_request = CachingRequest()
+token_cache = TokenCache(TOKEN_CACHE_SIZE)
+
+
+def verify_token(jwt: str) -> dict:
+    # Raises ValueError for invalid tokens, as id_token does
+    digest = hashlib.sha256(jwt.encode("utf-8")).hexdigest()
+    id_info = token_cache.get(digest)
+    if id_info is None:
+        id_info = id_token.verify_oauth2_token(jwt, cert_request, CLIENT_ID)
+        token_cache.put(digest, id_info)
+    return id_info
@@ -0,0 +1,5 @@
+# Entry point for production servers, e.g.
+#   gunicorn -c gunicorn.conf.py wsgi:app
+# main builds the app with create_app when it is imported; with preload_app
+# that happens once in the master process, before the workers are forked
+from main import app  # noqa: F401